@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Every case is BASELINE with one dimension changed, so each number isolates one cost.
+BASELINE = {
+    'size': 1000,
+    'bins': 100,
+    'format': 'png',
+    'width': 640,
+    'height': 480,
+    'axes': True,
+    'image_mode': 'rgba',
+    'backend': 'matplotlib',
+    'number': 100,
+}
+
+SWEEP = {
+    'size': [100000, 1000000],
+    'bins': [10, 1000],
+    'format': ['jpg', 'tiff'],
+    'width': [64],
+    'image_mode': ['gray', '1bit'],
+    'backend': ['raster'],
+    'number': [1000],
+    # Cases without output_format write one file per image.
+    'output_format': ['shards', 'npy', 'counts'],
+}
+
+QUICK_SWEEP = {
+    'size': [100000],
+    'backend': ['raster'],
+    'width': [64],
+}
+
+# write runs on the writer thread, alongside the others; write_wait is the time the
+# workers spent blocked on a full write queue.
+STAGES = ['sample', 'histogram', 'render', 'encode', 'write', 'write_wait']
+
+def get_cases(sweep):
+    cases = [dict(BASELINE)]
+    for name, values in sweep.items():
+        for value in values:
+            case = dict(BASELINE)
+            case[name] = value
+            if name == 'width':
+                # Small images are square and drawn without axes, as a model would use them.
+                case.update(height=value, axes=False)
+            cases.append(case)
+    return cases
+
+def get_case_key(case):
+    return json.dumps(case, sort_keys=True)
+
+def get_case_options(case):
+    return {
+        'backend': case['backend'],
+        'width': case['width'],
+        'height': case['height'],
+        'axes': case['axes'],
+        'image_mode': case['image_mode'],
+        'output_format': case.get('output_format', 'files'),
+        'manifest': None,
+        'progress': 'none',
+    }
+
+def run_case(case):
+    # Runs in a fresh interpreter, so ru_maxrss is the peak of this case alone.
+    from bin.normal_distribution_graph_generator import generate_normal_distribution_graphs
+    out_dir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            stats = generate_normal_distribution_graphs(out_dir, case['number'], 4, 50.0, 20.0, case['size'],
+                case['bins'], case['format'], seed=0, **get_case_options(case))
+            seconds = time.perf_counter() - start
+        output_bytes = sum(os.path.getsize(os.path.join(directory, name))
+            for directory, _, names in os.walk(out_dir) for name in names)
+    finally:
+        shutil.rmtree(out_dir)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+    return {
+        'case': case,
+        'seconds': seconds,
+        'images_per_sec': case['number'] / seconds,
+        'bytes_per_image': output_bytes / max(1, case['number']),
+        'stage_seconds_per_image': {
+            stage: stats['stage_seconds'].get(stage, 0.0) / max(1, case['number']) for stage in STAGES
+        },
+        'peak_rss_mb': peak_rss / (1 << 20),
+    }
+
+def run_case_subprocess(case):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', get_case_key(case)],
+        check=True, stdout=subprocess.PIPE, cwd=ROOT).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+def get_environment():
+    import numpy
+    import matplotlib
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        'revision': revision,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'matplotlib': matplotlib.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+def compare(results, baseline, threshold):
+    # Cases whose throughput dropped, or whose peak RSS grew, by more than threshold.
+    previous = {get_case_key(result['case']): result for result in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        old = previous.get(get_case_key(result['case']))
+        if old is None:
+            continue
+        if result['images_per_sec'] < old['images_per_sec'] * (1 - threshold):
+            regressions.append((result['case'], 'images_per_sec', old['images_per_sec'], result['images_per_sec']))
+        if result['peak_rss_mb'] > old['peak_rss_mb'] * (1 + threshold):
+            regressions.append((result['case'], 'peak_rss_mb', old['peak_rss_mb'], result['peak_rss_mb']))
+    return regressions
+
+def format_case(case):
+    changed = ["{}={}".format(name, value) for name, value in sorted(case.items()) if BASELINE.get(name) != value]
+    return ", ".join(changed) or "baseline"
+
+def print_result(result):
+    stages = result['stage_seconds_per_image']
+    print("{:<40} {:>9.1f} img/s {:>8.0f} B/img {:>7.1f} MiB  {}".format(
+        format_case(result['case']), result['images_per_sec'], result['bytes_per_image'], result['peak_rss_mb'],
+        " ".join("{} {:.2f}ms".format(stage, stages.get(stage, 0.0) * 1000) for stage in STAGES)))
+
+def get_args():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('-o', '--out', default="var/bench/results.json", help="Path of the JSON report")
+    argparser.add_argument('--quick', action='store_true', help="Run a small subset of the sweep")
+    argparser.add_argument('--compare', default=None, metavar='JSON', help="Earlier report to check for regressions")
+    argparser.add_argument('--threshold', default=0.2, help="Relative change reported as a regression")
+    argparser.add_argument('--case', default=None, help=argparse.SUPPRESS)
+    return argparser.parse_args()
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.case is not None:
+        print(json.dumps(run_case(json.loads(args.case))))
+        sys.exit(0)
+
+    results = {'environment': get_environment(), 'results': []}
+    for case in get_cases(QUICK_SWEEP if args.quick else SWEEP):
+        result = run_case_subprocess(case)
+        print_result(result)
+        results['results'].append(result)
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print("Wrote {}".format(args.out))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), float(args.threshold))
+        for case, metric, old, new in regressions:
+            print("REGRESSION {}: {} {:.1f} -> {:.1f}".format(format_case(case), metric, old, new))
+        sys.exit(1 if regressions else 0)
@@ -1,54 +1,2532 @@
 #!/usr/bin/env python
 
 import argparse
-import numpy as np
-import matplotlib.pyplot as plt
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
+import fcntl
+import glob
+import hashlib
+import http.server
+import importlib.util
+import itertools
+import io
+import json
+import math
+import multiprocessing
+import os
+import queue
+import secrets
+import signal
+import socketserver
+import stat
+import struct
+import sys
+import tarfile
+import threading
+import time
+import zlib
 
 
-def generate_normal_distribution_graphs(out_path_base, number, zerofill, loc, scale, size, bins, suffix):
-    for i in range(0, int(number)):
-        fig = plt.figure()
+def lazy_import(name):
+    # importlib's LazyLoader recipe: the module runs on its first attribute access, so
+    # --help, option errors and --dry-run return without paying for numpy.
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
 
-        data = np.random.normal(loc=loc, scale=scale, size=size)
-        plt.hist(data, bins=bins, color='black')
+np = lazy_import('numpy')
 
-        fig.patch.set_facecolor('white')
+def resolve_seed(seed):
+    if seed is None:
+        # The 128 bits of OS entropy np.random.SeedSequence() would draw.
+        return secrets.randbits(128)
+    return int(seed)
 
-        filename = "{}/{}_loc{}_scale{}_size{}_bins{}.{}".format(
-            out_path_base, str(i).zfill(zerofill), loc, scale, size, bins, suffix)
-        print("{}/{} {}".format(i+1, number, filename))
-        fig.savefig(filename)
+def get_rng(seed, is_normal_distribution, index):
+    # Every image owns a stream keyed by (label, index), so its pixels never depend on
+    # which worker rendered it or on how many images were drawn before it.
+    stream = 0 if is_normal_distribution else 1
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(stream, int(index))))
 
-def generate_not_normal_distribution_graphs(out_path_base, number, zerofill, loc1, loc2, scale1, scale2, size1, size2, bins, suffix):
-    for i in range(0, int(number)):
-        fig = plt.figure()
+def get_normal_distribution_filename(out_path_base, index, zerofill, loc, scale, size, bins, suffix):
+    return "{}/{}_loc{}_scale{}_size{}_bins{}.{}".format(
+        out_path_base, str(index).zfill(zerofill), loc, scale, size, bins, suffix)
 
-        data = np.concatenate(
-            [
-                np.random.normal(loc=loc1, scale=scale1, size=size1),
-                np.random.normal(loc=loc2, scale=scale2, size=size2)
-            ]
-        )
-        plt.hist(data, bins=bins, color='black')
+def get_not_normal_distribution_filename(out_path_base, index, zerofill, loc1, loc2, scale1, scale2, size1, size2, bins, suffix):
+    return "{}/{}_loc{}-{}_scale{}-{}_size{}-{}_bins{}.{}".format(
+        out_path_base, str(index).zfill(zerofill), loc1, loc2, scale1, scale2, size1, size2, bins, suffix)
 
-        fig.patch.set_facecolor('white')
+def sample_normal_distribution(rng, loc, scale, size):
+    return rng.normal(loc=loc, scale=scale, size=size)
 
-        filename = "{}/{}_loc{}-{}_scale{}-{}_size{}-{}_bins{}.{}".format(
-            out_path_base, str(i).zfill(zerofill), loc1, loc2, scale1, scale2, size1, size2, bins, suffix)
-        print("{}/{} {}".format(i+1, number, filename))
-        fig.savefig(filename)
+def sample_not_normal_distribution(rng, loc1, loc2, scale1, scale2, size1, size2):
+    return np.concatenate(
+        [
+            rng.normal(loc=loc1, scale=scale1, size=size1),
+            rng.normal(loc=loc2, scale=scale2, size=size2)
+        ]
+    )
+
+# Upper bound on samples held by one batch block (64 MiB of float64).
+BATCH_SAMPLE_LIMIT = 1 << 23
+
+def sample_normal_distribution_batch(rngs, loc, scale, size):
+    # Each row is filled in place from its image's own generator, which keeps image i
+    # identical to the unbatched path; scaling and shifting run once over the block.
+    block = np.empty((len(rngs), size))
+    for row, rng in zip(block, rngs):
+        rng.standard_normal(out=row)
+    block *= scale
+    block += loc
+    return block
+
+def sample_not_normal_distribution_batch(rngs, loc1, loc2, scale1, scale2, size1, size2):
+    block = np.empty((len(rngs), size1 + size2))
+    for row, rng in zip(block, rngs):
+        rng.standard_normal(out=row)
+    block[:, :size1] *= scale1
+    block[:, :size1] += loc1
+    block[:, size1:] *= scale2
+    block[:, size1:] += loc2
+    return block
+
+def sample_batch(is_normal_distribution, rngs, params):
+    return get_distribution(is_normal_distribution, params).sample(rngs, params)
+
+def get_sample_count(is_normal_distribution, params):
+    return get_distribution(is_normal_distribution, params).get_sample_count(params)
+
+def histogram_rows(data, bins, low=None, high=None):
+    # np.histogram(row, bins, range=(low, high)) for every row of a (batch, n) block in
+    # one pass: bin indices are offset by row * bins and counted with a single bincount.
+    # Rows default to their own (min, max) range like Axes.hist. Index arithmetic and
+    # edge corrections follow np.histogram so the counts are identical.
+    batch = data.shape[0]
+    low = data.min(axis=1) if low is None else np.broadcast_to(np.asarray(low, dtype=float), (batch,))
+    high = data.max(axis=1) if high is None else np.broadcast_to(np.asarray(high, dtype=float), (batch,))
+    low = low.astype(float)
+    high = high.astype(float)
+    empty = low == high
+    low[empty] -= 0.5
+    high[empty] += 0.5
+    edges = np.linspace(low, high, bins + 1, axis=1)
+
+    rows = np.arange(batch)[:, None]
+    keep = (data >= low[:, None]) & (data <= high[:, None])
+    clipped = np.where(keep, data, low[:, None])
+    indices = ((clipped - low[:, None]) / (high - low)[:, None] * bins).astype(np.intp)
+    indices[indices == bins] -= 1
+    indices -= clipped < edges[rows, indices]
+    indices += (clipped >= edges[rows, indices + 1]) & (indices != bins - 1)
+
+    flat = np.where(keep, indices + rows * bins, batch * bins)
+    counts = np.bincount(flat.ravel(), minlength=batch * bins + 1)[:-1].reshape(batch, bins)
+    return counts, edges
+
+def get_components(is_normal_distribution, params):
+    if is_normal_distribution:
+        return [(params['loc'], params['scale'], params['size'])]
+    return [(params['loc1'], params['scale1'], params['size1']), (params['loc2'], params['scale2'], params['size2'])]
+
+def get_default_range(components):
+    # Fixed histogram range for the multinomial mode: 5 sigma around every component.
+    return (min(loc - 5 * scale for loc, scale, _ in components),
+        max(loc + 5 * scale for loc, scale, _ in components))
+
+def _erfc(x):
+    return np.frompyfunc(math.erfc, 1, 1)(x)
+
+def get_bin_probabilities(loc, scale, edges):
+    # [P(x < edges[0]), P(edges[k] <= x < edges[k+1])..., P(x >= edges[-1])]. Lower
+    # tails come from the CDF and upper tails from the survival function, both via
+    # erfc, so tail bins keep their precision at sizes of 10^10.
+    z = (np.asarray(edges, dtype=float) - loc) / (scale * math.sqrt(2))
+    cdf = 0.5 * _erfc(-z).astype(float)
+    sf = 0.5 * _erfc(z).astype(float)
+    probabilities = np.where(edges[1:] <= loc, cdf[1:] - cdf[:-1], sf[:-1] - sf[1:])
+    probabilities = np.concatenate([[cdf[0]], np.maximum(probabilities, 0.0), [sf[-1]]])
+    return probabilities / probabilities.sum()
+
+def apply_out_of_range(counts, out_of_range):
+    # counts carries the below/above range tails in its first and last columns.
+    if out_of_range == 'clip':
+        counts[..., 1] += counts[..., 0]
+        counts[..., -2] += counts[..., -1]
+    elif out_of_range != 'drop':
+        raise ValueError("Unknown out-of-range policy: {}".format(out_of_range))
+    return counts[..., 1:-1]
+
+def multinomial_histogram(rng, plan, out_of_range='drop'):
+    # Exact in distribution: n iid draws land in the bins with multinomial counts, so
+    # memory and time depend on the number of bins only. plan is a list of
+    # (size, probabilities) pairs, one per independently drawn group of samples.
+    counts = sum(rng.multinomial(size, p) for size, p in plan)
+    return apply_out_of_range(counts, out_of_range)
+
+def stream_samples(rng, components, chunk_size):
+    # Replays the exact sample stream of the materializing path chunk by chunk.
+    for loc, scale, size in components:
+        for start in range(0, size, chunk_size):
+            chunk = rng.standard_normal(min(chunk_size, size - start))
+            chunk *= scale
+            chunk += loc
+            yield chunk
+
+def stream_histogram(make_chunks, bins, hist_range=None, out_of_range='drop'):
+    # make_chunks() starts the sample stream of one image over. Without a fixed range the first pass finds (min, max) and the second pass
+    # regenerates the same stream to count it, matching Axes.hist's auto range.
+    if hist_range is None:
+        low, high = np.inf, -np.inf
+        for chunk in make_chunks():
+            low = min(low, chunk.min())
+            high = max(high, chunk.max())
+        out_of_range = 'drop'
+    else:
+        low, high = hist_range
+    counts = np.zeros(bins + 2, dtype=np.int64)
+    for chunk in make_chunks():
+        chunk_counts, edges = histogram_rows(chunk[None, :], bins, low, high)
+        counts[1:-1] += chunk_counts[0]
+        counts[0] += np.count_nonzero(chunk < edges[0, 0])
+        counts[-1] += np.count_nonzero(chunk > edges[0, -1])
+    return apply_out_of_range(counts, out_of_range), edges[0]
+
+def integrate_density(pdf, z, nodes=32):
+    # Bin probabilities, tails included, of a standardized density without a closed-form
+    # CDF at the standardized edges z. z = tan(t) maps the real line onto
+    # (-pi/2, pi/2), where every interval is finite and Gauss-Legendre integrated.
+    t = np.concatenate([[-np.pi / 2], np.arctan(z), [np.pi / 2]])
+    x, w = np.polynomial.legendre.leggauss(nodes)
+    middle = (t[1:] + t[:-1]) / 2
+    half = (t[1:] - t[:-1]) / 2
+    u = np.tan(middle[:, None] + half[:, None] * x)
+    probabilities = np.maximum((pdf(u) * (1 + u * u)) @ w * half, 0.0)
+    return probabilities / probabilities.sum()
+
+def normal_cdf(z):
+    return 0.5 * _erfc(-np.asarray(z) / math.sqrt(2)).astype(float)
+
+def format_param(value):
+    if isinstance(value, (list, tuple)):
+        return "-".join(str(item) for item in value)
+    return str(value)
+
+class Distribution:
+    # A sampler of the distribution registry. sample() draws a (batch, n) block with
+    # one generator per row, stream() replays one row chunk by chunk for the streaming
+    # mode, and get_multinomial_plan() gives the bin probabilities the multinomial mode
+    # draws counts from. names are the parameters next to 'distribution'.
+    name = None
+    names = []
+    defaults = {}
+
+    def get_sample_count(self, params):
+        return params['size']
+
+    def get_filename(self, out_path_base, index, zerofill, params, suffix):
+        return "{}/{}_{}_{}.{}".format(out_path_base, str(index).zfill(zerofill), self.name,
+            "_".join("{}{}".format(name, format_param(params[name])) for name in self.names), suffix)
+
+class NormalComponentsDistribution(Distribution):
+    # The original classes: a normal, or two normal components of fixed sizes.
+    def __init__(self, is_normal_distribution):
+        self.is_normal_distribution = is_normal_distribution
+        self.name = 'normal' if is_normal_distribution else 'bimodal'
+        self.names = list(NORMAL_DISTRIBUTION_PARAMS if is_normal_distribution else NOT_NORMAL_DISTRIBUTION_PARAMS)
+        self.defaults = NORMAL_DISTRIBUTION_PARAMS if is_normal_distribution else NOT_NORMAL_DISTRIBUTION_PARAMS
+
+    def get_sample_count(self, params):
+        return sum(size for _, _, size in get_components(self.is_normal_distribution, params))
+
+    def sample(self, rngs, params):
+        if self.is_normal_distribution:
+            return sample_normal_distribution_batch(rngs, params['loc'], params['scale'], params['size'])
+        return sample_not_normal_distribution_batch(rngs, params['loc1'], params['loc2'],
+            params['scale1'], params['scale2'], params['size1'], params['size2'])
+
+    def stream(self, rng, params, chunk_size):
+        return stream_samples(rng, get_components(self.is_normal_distribution, params), chunk_size)
+
+    def get_default_range(self, params):
+        return get_default_range(get_components(self.is_normal_distribution, params))
+
+    def get_multinomial_plan(self, params, edges):
+        return [(size, get_bin_probabilities(loc, scale, edges))
+            for loc, scale, size in get_components(self.is_normal_distribution, params)]
+
+    def get_filename(self, out_path_base, index, zerofill, params, suffix):
+        if self.is_normal_distribution:
+            return get_normal_distribution_filename(out_path_base, index, zerofill,
+                params['loc'], params['scale'], params['size'], params['bins'], suffix)
+        return get_not_normal_distribution_filename(out_path_base, index, zerofill,
+            params['loc1'], params['loc2'], params['scale1'], params['scale2'],
+            params['size1'], params['size2'], params['bins'], suffix)
+
+class MixtureDistribution(Distribution):
+    # K weighted normal components. A histogram does not depend on sample order, so the
+    # per-sample categorical draw is taken in aggregate as one multinomial split of
+    # size; one fused standard normal draw is then scaled and shifted in place, one
+    # contiguous component slice at a time.
+    name = 'mixture'
+    names = ['locs', 'scales', 'weights', 'size', 'bins']
+    defaults = {'locs': [25.0, 50.0, 75.0], 'scales': [10.0, 10.0, 10.0], 'weights': [0.3, 0.4, 0.3],
+        'size': 1000, 'bins': 100}
+
+    def get_weights(self, params):
+        weights = np.asarray(params['weights'], dtype=float)
+        if not len(params['locs']) == len(params['scales']) == len(weights) or (weights < 0).any() or not weights.sum() > 0:
+            raise ValueError("Invalid mixture: locs {}, scales {}, weights {}".format(
+                params['locs'], params['scales'], params['weights']))
+        return weights / weights.sum()
+
+    def get_bounds(self, rng, params):
+        return np.concatenate([[0], np.cumsum(rng.multinomial(params['size'], self.get_weights(params)))])
+
+    def shift(self, chunk, start, bounds, params):
+        for loc, scale, low, high in zip(params['locs'], params['scales'], bounds[:-1], bounds[1:]):
+            component = chunk[max(low - start, 0):max(high - start, 0)]
+            component *= scale
+            component += loc
+
+    def sample(self, rngs, params):
+        block = np.empty((len(rngs), params['size']))
+        for row, rng in zip(block, rngs):
+            bounds = self.get_bounds(rng, params)
+            rng.standard_normal(out=row)
+            self.shift(row, 0, bounds, params)
+        return block
+
+    def stream(self, rng, params, chunk_size):
+        bounds = self.get_bounds(rng, params)
+        for start in range(0, params['size'], chunk_size):
+            chunk = rng.standard_normal(min(chunk_size, params['size'] - start))
+            self.shift(chunk, start, bounds, params)
+            yield chunk
+
+    def get_default_range(self, params):
+        return get_default_range(list(zip(params['locs'], params['scales'], params['weights'])))
+
+    def get_multinomial_plan(self, params, edges):
+        probabilities = sum(weight * get_bin_probabilities(loc, scale, edges)
+            for loc, scale, weight in zip(params['locs'], params['scales'], self.get_weights(params)))
+        return [(params['size'], probabilities / probabilities.sum())]
+
+class LocationScaleDistribution(Distribution):
+    # loc + scale * z for a standardized variate z, which fill() draws in place.
+    names = ['loc', 'scale', 'shape', 'size', 'bins']
+
+    def sample(self, rngs, params):
+        block = np.empty((len(rngs), params['size']))
+        for row, rng in zip(block, rngs):
+            self.fill(rng, row, params)
+        block *= params['scale']
+        block += params['loc']
+        return block
+
+    def stream(self, rng, params, chunk_size):
+        for start in range(0, params['size'], chunk_size):
+            chunk = np.empty(min(chunk_size, params['size'] - start))
+            self.fill(rng, chunk, params)
+            chunk *= params['scale']
+            chunk += params['loc']
+            yield chunk
+
+    def get_standard_range(self, params):
+        return (-5.0, 5.0)
+
+    def get_default_range(self, params):
+        low, high = self.get_standard_range(params)
+        return (params['loc'] + params['scale'] * low, params['loc'] + params['scale'] * high)
+
+    def get_multinomial_plan(self, params, edges):
+        z = (np.asarray(edges, dtype=float) - params['loc']) / params['scale']
+        return [(params['size'], self.get_probabilities(z, params))]
+
+class SkewNormalDistribution(LocationScaleDistribution):
+    # shape is the skewness parameter alpha; z = delta * |u| + sqrt(1 - delta^2) * v.
+    name = 'skewnormal'
+    defaults = {'loc': 50.0, 'scale': 20.0, 'shape': 4.0, 'size': 1000, 'bins': 100}
+
+    def fill(self, rng, out, params):
+        delta = params['shape'] / math.sqrt(1 + params['shape'] ** 2)
+        pairs = rng.standard_normal((len(out), 2))
+        np.abs(pairs[:, 0], out=out)
+        out *= delta
+        out += pairs[:, 1] * math.sqrt(1 - delta ** 2)
+
+    def get_probabilities(self, z, params):
+        return integrate_density(
+            lambda u: np.exp(-u * u / 2) * math.sqrt(2 / math.pi) * normal_cdf(params['shape'] * u), z)
+
+class StudentTDistribution(LocationScaleDistribution):
+    # shape is the number of degrees of freedom.
+    name = 'student_t'
+    defaults = {'loc': 50.0, 'scale': 20.0, 'shape': 3.0, 'size': 1000, 'bins': 100}
+
+    def fill(self, rng, out, params):
+        out[:] = rng.standard_t(params['shape'], len(out))
+
+    def get_probabilities(self, z, params):
+        df = params['shape']
+        norm = math.exp(math.lgamma((df + 1) / 2) - math.lgamma(df / 2)) / math.sqrt(df * math.pi)
+        return integrate_density(lambda u: norm * (1 + u * u / df) ** (-(df + 1) / 2), z)
+
+class UniformDistribution(LocationScaleDistribution):
+    # Uniform with mean loc and standard deviation scale.
+    name = 'uniform'
+    names = ['loc', 'scale', 'size', 'bins']
+    defaults = {'loc': 50.0, 'scale': 20.0, 'size': 1000, 'bins': 100}
+
+    def fill(self, rng, out, params):
+        rng.random(out=out)
+        out *= 2 * math.sqrt(3)
+        out -= math.sqrt(3)
+
+    def get_standard_range(self, params):
+        return (-math.sqrt(3), math.sqrt(3))
+
+    def get_probabilities(self, z, params):
+        cdf = np.clip((z + math.sqrt(3)) / (2 * math.sqrt(3)), 0.0, 1.0)
+        return np.concatenate([[cdf[0]], np.diff(cdf), [1.0 - cdf[-1]]])
+
+class LogNormalDistribution(LocationScaleDistribution):
+    # loc + scale * exp(shape * u): loc is the lower bound and loc + scale the median.
+    name = 'lognormal'
+    defaults = {'loc': 30.0, 'scale': 20.0, 'shape': 0.5, 'size': 1000, 'bins': 100}
+
+    def fill(self, rng, out, params):
+        rng.standard_normal(out=out)
+        out *= params['shape']
+        np.exp(out, out=out)
+
+    def get_standard_range(self, params):
+        return (0.0, math.exp(5 * params['shape']))
+
+    def get_probabilities(self, z, params):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_z = np.where(z > 0, np.log(np.maximum(z, 0.0)), -np.inf)
+        return get_bin_probabilities(0.0, params['shape'], log_z)
+
+NORMAL_DISTRIBUTION_PARAMS = {'loc': 50.0, 'scale': 20.0, 'size': 1000, 'bins': 100}
+NOT_NORMAL_DISTRIBUTION_PARAMS = {'loc1': 25.0, 'loc2': 75.0, 'scale1': 20.0, 'scale2': 20.0, 'size1': 500, 'size2': 500, 'bins': 100}
+
+DISTRIBUTIONS = {
+    'normal': NormalComponentsDistribution(True),
+    'bimodal': NormalComponentsDistribution(False),
+    'mixture': MixtureDistribution(),
+    'skewnormal': SkewNormalDistribution(),
+    'student_t': StudentTDistribution(),
+    'uniform': UniformDistribution(),
+    'lognormal': LogNormalDistribution(),
+}
+
+def get_distribution(is_normal_distribution, params):
+    # Parameters without a 'distribution' key belong to the original normal and
+    # two-component classes, whose file names and metadata stay as they were.
+    name = params.get('distribution', 'normal' if is_normal_distribution else 'bimodal')
+    if name not in DISTRIBUTIONS:
+        raise ValueError("Unknown distribution: {}".format(name))
+    return DISTRIBUTIONS[name]
+
+def to_grayscale(rgba):
+    # ITU-R 601 luma of an RGBA8 buffer; the alpha channel is opaque for these figures.
+    luma = rgba[..., :3].astype(np.uint32) @ np.array([299, 587, 114], dtype=np.uint32)
+    return ((luma + 500) // 1000).astype(np.uint8)
+
+class HistogramRenderer:
+    # One Agg figure and one bar container, reused for every image a worker draws. Only
+    # the bar geometry and the data limits change between images, so memory stays flat.
+    # The defaults give pyplot's 640x480 figure; without axes the plot fills the canvas.
+    def __init__(self, width=640, height=480, dpi=100, axes=True):
+        # Imported here so that only processes that draw with matplotlib load it. The Agg
+        # canvas is attached directly, so no GUI backend is ever looked up.
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        self.figure = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.figure.patch.set_facecolor('white')
+        if axes:
+            self.axes = self.figure.add_subplot()
+        else:
+            self.axes = self.figure.add_axes((0, 0, 1, 1))
+            self.axes.set_axis_off()
+        self.bars = None
+
+    def draw(self, counts, edges):
+        # Same bar geometry as Axes.hist(histtype='bar'): centered bars spanning each bin.
+        widths = np.diff(edges)
+        centers = edges[:-1] + 0.5 * widths
+        if self.bars is None or len(self.bars) != len(counts):
+            if self.bars is not None:
+                self.bars.remove()
+            self.bars = self.axes.bar(centers, counts, widths, align='center', color='black')
+        else:
+            for bar, center, width, count in zip(self.bars, centers, widths, counts):
+                bar.set_x(center - width / 2)
+                bar.set_width(width)
+                bar.set_height(count)
+        # The limits autoscale_view() would find, without walking every patch: the bar
+        # extent plus 5% margins in x, and y from 0 (the bars' sticky edge) plus 5%.
+        top = np.max(counts)
+        if top <= 0:
+            self.axes.relim()
+            self.axes.autoscale_view()
+            return
+        left = np.min(centers - widths / 2)
+        right = np.max(centers - widths / 2 + widths)
+        margin = (right - left) * self.axes.margins()[0]
+        self.axes.set_xlim(left - margin, right + margin)
+        self.axes.set_ylim(0.0, top + top * self.axes.margins()[1])
+
+    def draw_data(self, data, bins):
+        counts, edges = np.histogram(data, bins=bins, range=(data.min(), data.max()))
+        self.draw(counts.astype(float), edges.astype(float))
+
+    def save(self, filename, **kwargs):
+        self.figure.savefig(filename, **kwargs)
+
+    def encode(self, suffix, image_mode='rgba', compress_level=None, quality=None):
+        if image_mode != 'rgba':
+            return encode_image(self.to_array(), suffix.lower(), image_mode, compress_level, quality)
+        pil_kwargs = {}
+        if compress_level is not None and suffix.lower() == 'png':
+            pil_kwargs['compress_level'] = compress_level
+        if quality is not None and suffix.lower() in ['jpg', 'jpeg']:
+            pil_kwargs['quality'] = quality
+        buffer = io.BytesIO()
+        self.figure.savefig(buffer, format=suffix, **({'pil_kwargs': pil_kwargs} if pil_kwargs else {}))
+        return buffer.getvalue()
+
+    @property
+    def shape(self):
+        width, height = self.figure.canvas.get_width_height()
+        return (height, width)
+
+    def to_array(self):
+        self.figure.canvas.draw()
+        rgba = np.asarray(self.figure.canvas.buffer_rgba())
+        return to_grayscale(rgba)
+
+def get_nice_ticks(vmin, vmax, nbins=9, steps=(1, 2, 2.5, 5, 10)):
+    # A reduced MaxNLocator: the smallest "nice" step giving at most nbins intervals.
+    scale = 10 ** math.floor(math.log10((vmax - vmin) / nbins))
+    for step in sorted(s * scale for s in steps):
+        if step >= (vmax - vmin) / nbins:
+            break
+    first = math.ceil(vmin / step - 1e-10)
+    last = math.floor(vmax / step + 1e-10)
+    return [i * step for i in range(first, last + 1)]
+
+def encode_png(image, compress_level=6, bit_depth=8):
+    # 8-bit or 1-bit (threshold at mid-gray) grayscale PNG. Every row uses the "Up"
+    # filter: the stacked bars repeat vertically, so filtered rows are mostly zeros and
+    # deflate very quickly.
+    height, width = image.shape
+    rows = image if bit_depth == 8 else np.packbits(image >= 128, axis=1)
+    filtered = np.empty((height, rows.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 0] = 2
+    filtered[0, 1:] = rows[0]
+    filtered[1:, 1:] = rows[1:] - rows[:-1]
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, 0, 0, 0, 0)),
+        chunk(b"IDAT", zlib.compress(filtered.tobytes(), compress_level)),
+        chunk(b"IEND", b""),
+    ])
+
+IMAGE_MODES = ['rgba', 'gray', '1bit']
+
+def encode_image(image, suffix, image_mode='gray', compress_level=None, quality=None):
+    # Single-channel encoding of a uint8 image. compress_level is the zlib level of PNG
+    # and, for TIFF, turns on deflate (group 4 for 1-bit) when above 0; quality is the
+    # JPEG quality. JPEG has no 1-bit mode.
+    bilevel = image_mode == '1bit'
+    if suffix == 'png':
+        return encode_png(image, 6 if compress_level is None else compress_level, 1 if bilevel else 8)
+    from PIL import Image
+    format = Image.registered_extensions()['.' + suffix]
+    kwargs = {}
+    if format == 'JPEG':
+        if bilevel:
+            raise ValueError("1-bit images cannot be encoded as JPEG")
+        if quality is not None:
+            kwargs['quality'] = quality
+    elif format == 'TIFF' and compress_level:
+        kwargs['compression'] = 'group4' if bilevel else 'tiff_adobe_deflate'
+    pil_image = Image.fromarray(image >= 128) if bilevel else Image.fromarray(image, mode='L')
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format=format, **kwargs)
+    return buffer.getvalue()
+
+class RasterRenderer:
+    # Paints the histogram straight into a uint8 array without matplotlib. The canvas,
+    # axes box, data limits and bars follow matplotlib's defaults (640x480 at 100 dpi,
+    # 5% x margin, y from 0); the frame and ticks are 1px marks and there are no tick
+    # labels, so this is a minimal variant of the HistogramRenderer image. Without axes
+    # the bars span the whole canvas.
+    def __init__(self, width=640, height=480, dpi=100, axes=True):
+        self.width = width
+        self.height = height
+        self.axes = axes
+        self.background = np.full((height, width), 255, dtype=np.uint8)
+        if axes:
+            self.left = int(round(0.125 * width))
+            self.right = int(round(0.9 * width))
+            self.top = int(round((1 - 0.88) * height))
+            self.bottom = int(round((1 - 0.11) * height))
+            self.tick_length = int(round(3.5 / 72 * dpi))
+            self.background[self.top, self.left:self.right + 1] = 0
+            self.background[self.bottom, self.left:self.right + 1] = 0
+            self.background[self.top:self.bottom + 1, self.left] = 0
+            self.background[self.top:self.bottom + 1, self.right] = 0
+        else:
+            self.left, self.right, self.top, self.bottom = 0, width - 1, 0, height - 1
+        self.rows = np.arange(height)[:, None]
+        self.image = self.background.copy()
+
+    def draw(self, counts, edges):
+        counts = np.asarray(counts, dtype=float)
+        edges = np.asarray(edges, dtype=float)
+        margin = 0.05 * (edges[-1] - edges[0])
+        xmin, xmax = edges[0] - margin, edges[-1] + margin
+        ymax = 1.05 * counts.max() if counts.max() > 0 else 1.0
+        x_scale = (self.right - self.left) / (xmax - xmin)
+        y_scale = (self.bottom - self.top) / ymax
+
+        # Column -> bar lookup, then one broadcast comparison paints every bar.
+        edge_columns = np.rint(self.left + (edges - xmin) * x_scale).astype(np.intp)
+        tops = np.full(self.width, self.height, dtype=np.intp)
+        bar_tops = np.rint(self.bottom - counts * y_scale).astype(np.intp)
+        columns = np.arange(edge_columns[0], edge_columns[-1])
+        tops[columns] = bar_tops[np.searchsorted(edge_columns, columns, side='right') - 1]
+        image = self.image
+        np.copyto(image, self.background)
+        image[(self.rows >= tops) & (self.rows <= self.bottom)] = 0
+        if not self.axes:
+            return
+
+        for x in get_nice_ticks(xmin, xmax):
+            column = int(round(self.left + (x - xmin) * x_scale))
+            image[self.bottom:self.bottom + self.tick_length + 1, column] = 0
+        for y in get_nice_ticks(0.0, ymax):
+            row = int(round(self.bottom - y * y_scale))
+            image[row, self.left - self.tick_length:self.left + 1] = 0
+
+    def draw_data(self, data, bins):
+        counts, edges = np.histogram(data, bins=bins, range=(data.min(), data.max()))
+        self.draw(counts, edges)
+
+    def encode(self, suffix, image_mode='gray', compress_level=None, quality=None):
+        # The raster is grayscale already, so 'rgba' is written as 'gray'.
+        return encode_image(self.image, suffix.lower(), 'gray' if image_mode == 'rgba' else image_mode,
+            compress_level, quality)
+
+    @property
+    def shape(self):
+        return (self.height, self.width)
+
+    def to_array(self):
+        return self.image
+
+    def save(self, filename, format=None):
+        encoded = self.encode(format or filename.rsplit('.', 1)[-1])
+        if hasattr(filename, 'write'):
+            filename.write(encoded)
+        else:
+            with open(filename, 'wb') as f:
+                f.write(encoded)
+
+RENDERERS = {
+    'matplotlib': HistogramRenderer,
+    'raster': RasterRenderer,
+}
+
+# Renderers hold mutable figure state, so each thread of each process keeps its own.
+_renderers = threading.local()
+
+def get_renderer(backend='matplotlib', width=640, height=480, dpi=100, axes=True):
+    renderers = _renderers.__dict__
+    key = (backend, width, height, dpi, axes)
+    if key not in renderers:
+        renderers[key] = RENDERERS[backend](width, height, dpi, axes)
+    return renderers[key]
+
+def get_filename(is_normal_distribution, out_path_base, index, zerofill, params, suffix):
+    return get_distribution(is_normal_distribution, params).get_filename(out_path_base, index, zerofill, params, suffix)
+
+def get_output_path(is_normal_distribution, out_path_base, index, zerofill, params, suffix, seed, options):
+    # With fanout N the file goes to OUT/LABEL/ab/cd/.../ (N levels of 256 directories)
+    # named after a hash of (seed, index), which also prefixes the file name, so runs
+    # with different seeds never overwrite each other and directories stay small.
+    filename = get_filename(is_normal_distribution, out_path_base, index, zerofill, params, suffix)
+    fanout = int(options['fanout'])
+    if not fanout:
+        return filename
+    key = sha256("{}-{}".format(seed, index).encode())
+    directory = os.path.join(out_path_base, *[key[2 * level:2 * level + 2] for level in range(fanout)])
+    return os.path.join(directory, "{}_{}".format(key[:16], os.path.basename(filename)))
+
+# Seconds spent per pipeline stage by this process; the writer thread adds to 'write'.
+_stage_seconds = collections.Counter()
+_stage_lock = threading.Lock()
+
+@contextlib.contextmanager
+def timed_stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _stage_lock:
+            _stage_seconds[name] += elapsed
+
+def get_stage_seconds():
+    with _stage_lock:
+        return dict(_stage_seconds)
+
+# (images, busy seconds) shared by every process of the running generation.
+_progress = None
+
+def init_progress(images=None, busy=None):
+    global _progress
+    _progress = None if images is None else (images, busy)
+
+def add_progress(images, seconds):
+    if _progress is None:
+        return
+    with _progress[0].get_lock():
+        _progress[0].value += images
+    with _progress[1].get_lock():
+        _progress[1].value += seconds
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+class ProgressReporter:
+    # Replaces the per-image lines with one status line on stderr at most every interval
+    # seconds: images done, rate, ETA and utilization, the share of the workers' time
+    # spent generating (low values mean the workers wait on the pool or stragglers).
+    # Counters of a long-lived pool can be passed in; only what is added after
+    # __enter__ counts toward this run.
+    def __init__(self, label, total, workers=1, interval=1.0, enabled=True, images=None, busy=None):
+        self.label = label
+        self.total = total
+        self.workers = max(1, int(workers))
+        self.interval = float(interval)
+        self.enabled = enabled
+        self.images = multiprocessing.Value('q', 0) if images is None else images
+        self.busy = multiprocessing.Value('d', 0.0) if busy is None else busy
+        self.base = (0, 0.0)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.start = time.perf_counter()
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.base = (self.images.value, self.busy.value)
+        if self.enabled:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.report()
+        return False
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def get_status(self):
+        elapsed = time.perf_counter() - self.start
+        images = self.images.value - self.base[0]
+        busy = self.busy.value - self.base[1]
+        rate = images / elapsed if elapsed > 0 else 0.0
+        return {
+            'images': images,
+            'seconds': elapsed,
+            'images_per_sec': rate,
+            'eta': (self.total - images) / rate if rate > 0 else None,
+            'utilization': min(1.0, busy / (elapsed * self.workers)) if elapsed > 0 else 0.0,
+        }
+
+    def report(self):
+        status = self.get_status()
+        print("{}: {}/{} images, {:.1f} images/s, ETA {}, utilization {:.0%}".format(
+            self.label, status['images'], self.total, status['images_per_sec'],
+            "-" if status['eta'] is None else format_duration(status['eta']), status['utilization']),
+            file=sys.stderr, flush=True)
+
+_profiler = None
+
+def run_task(function, task, options):
+    # Runs one work item and returns the stage seconds it added and its result. With a profile
+    # directory each process accumulates one cProfile and rewrites
+    # DIR/worker-PID.prof after every item, so the file is current even if the
+    # pool is killed.
+    global _profiler
+    before = get_stage_seconds()
+    if options['profile']:
+        if _profiler is None:
+            _profiler = cProfile.Profile()
+        try:
+            result = _profiler.runcall(function, *task)
+        finally:
+            _profiler.dump_stats(os.path.join(options['profile'], "worker-{}.prof".format(os.getpid())))
+    else:
+        result = function(*task)
+    return {stage: seconds - before.get(stage, 0.0) for stage, seconds in get_stage_seconds().items()}, result
+
+def run_tasks(label, function, tasks, total, workers, options, results=None):
+    # Runs function(*task) for every task in this process or in a pool of workers and
+    # returns the run's statistics: images, seconds, rate, utilization and summed
+    # stage seconds. The return values of function are appended to results, in
+    # completion order.
+    workers = int(workers)
+    results = [] if results is None else results
+    if options['profile']:
+        os.makedirs(options['profile'], exist_ok=True)
+    if _worker_pool is not None:
+        return _worker_pool.run_tasks(label, function, tasks, total, options, results)
+    stages = collections.Counter()
+    reporter = ProgressReporter(label, total, workers, options['progress_interval'], options['progress'] == 'rate')
+    with reporter:
+        if workers <= 1:
+            init_progress(reporter.images, reporter.busy)
+            try:
+                for task in tasks:
+                    stage_seconds, result = run_task(function, task, options)
+                    stages.update(stage_seconds)
+                    results.append(result)
+            finally:
+                init_progress()
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_progress,
+                    initargs=(reporter.images, reporter.busy)) as executor:
+                futures = [executor.submit(run_task, function, task, options) for task in tasks]
+                for future in concurrent.futures.as_completed(futures):
+                    stage_seconds, result = future.result()
+                    stages.update(stage_seconds)
+                    results.append(result)
+    return get_run_stats(reporter, label, workers, stages)
+
+def get_run_stats(reporter, label, workers, stages):
+    stats = reporter.get_status()
+    del stats['eta']
+    stats.update(label=label, workers=max(1, workers), stage_seconds=dict(stages))
+    return stats
+
+def warm_worker(images, busy, options):
+    # Pool initializer of the server: loads the renderer and draws and encodes one image,
+    # so imports, font caches and the figure are ready before the first request. Ctrl-C
+    # is left to the server, which shuts the pool down.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_progress(images, busy)
+    renderer = get_options_renderer(options)
+    renderer.draw(np.ones(10), np.arange(11.0))
+    renderer.encode('png', **get_encoding(options))
+
+class WorkerPool:
+    # A process pool that outlives single runs. While it is installed, run_tasks sends
+    # every run to it instead of starting processes, one run at a time.
+    def __init__(self, workers, options):
+        self.workers = max(1, int(workers))
+        self.images = multiprocessing.Value('q', 0)
+        self.busy = multiprocessing.Value('d', 0.0)
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=warm_worker,
+            initargs=(self.images, self.busy, get_options(options)))
+        concurrent.futures.wait([self.executor.submit(os.getpid) for _ in range(self.workers)])
+
+    def run_tasks(self, label, function, tasks, total, options, results):
+        stages = collections.Counter()
+        with self.lock:
+            reporter = ProgressReporter(label, total, self.workers, options['progress_interval'],
+                options['progress'] == 'rate', self.images, self.busy)
+            with reporter:
+                futures = [self.executor.submit(run_task, function, task, options) for task in tasks]
+                for future in concurrent.futures.as_completed(futures):
+                    stage_seconds, result = future.result()
+                    stages.update(stage_seconds)
+                    results.append(result)
+            return get_run_stats(reporter, label, self.workers, stages)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+_worker_pool = None
+
+def install_worker_pool(pool):
+    global _worker_pool
+    _worker_pool = pool
+
+def get_record_key(record):
+    # Records that differ only in index, path and hash belong to one run of one
+    # parameter point; the manifest index keeps one set of ranges per key.
+    return json.dumps({name: value for name, value in record.items() if name not in ['index', 'path', 'sha256']},
+        sort_keys=True)
+
+def get_index_ranges(indices):
+    # Sorted, disjoint [start, stop) ranges covering a collection of indices.
+    ranges = []
+    for index in sorted(indices):
+        if ranges and ranges[-1][1] == index:
+            ranges[-1][1] += 1
+        elif not ranges or ranges[-1][1] < index:
+            ranges.append([index, index + 1])
+    return ranges
+
+def merge_ranges(ranges):
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return merged
+
+def read_record_ranges(path):
+    # {key: ranges} of a JSONL file of records, skipping a torn last line.
+    ranges = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            ranges.setdefault(get_record_key(record), []).append([record['index'], record['index'] + 1])
+    return {key: merge_ranges(key_ranges) for key, key_ranges in ranges.items()}
+
+def write_json(path, data):
+    with open(path + ".tmp", 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+class ManifestSegment:
+    # Appends records, with the fields shared by the whole task, to its JSONL file and
+    # tracks the indices they cover; close() writes those as ranges per record key to a
+    # .ranges.json next to it. The file is locked while the task runs, so that a fold
+    # leaves it alone; the lock goes with the process if the task is killed.
+    def __init__(self, path, fields=None):
+        # Locked before it is renamed to a name a fold looks for.
+        self.file = open(path + ".tmp", 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        os.replace(path + ".tmp", path)
+        self.path = path
+        self.fields = fields or {}
+        self.ranges = {}
+
+    def add(self, record):
+        record = dict(record, **self.fields)
+        self.file.write(json.dumps(record, sort_keys=True) + "\n")
+        self.file.flush()
+        ranges = self.ranges.setdefault(get_record_key(record), [])
+        if ranges and ranges[-1][1] == record['index']:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([record['index'], record['index'] + 1])
+
+    def close(self):
+        # The ranges are written while the lock is held; a fold reads them after.
+        write_json(get_ranges_path(self.path), {key: merge_ranges(ranges) for key, ranges in self.ranges.items()})
+        self.file.close()
+
+def get_ranges_path(segment_path):
+    return segment_path[:-len(".jsonl")] + ".ranges.json"
+
+def is_locked(path):
+    with open(path) as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+    return False
+
+class Manifest:
+    # A directory of append-only JSONL segments, one per worker task. A record is
+    # appended only after its output has been renamed into place, so a preempted run
+    # loses at most a torn last line, which readers skip. fold() appends the segments of
+    # finished tasks to manifest.jsonl and merges their ranges into index.json, the
+    # completed index ranges per record key, so a rerun reads that small file instead of
+    # every record. Only a generation run folds; fold(write=False) and load() (the
+    # records themselves, for merge, read_index and --verify-manifest) change nothing
+    # and can run while tasks are still writing, or on a read-only mount.
+    def __init__(self, path):
+        self.path = path
+
+    def get_segments(self):
+        # Least recently written first.
+        return sorted(glob.glob(os.path.join(glob.escape(self.path), "segment-*.jsonl")),
+            key=lambda path: (os.stat(path).st_mtime_ns, path))
+
+    def read_index(self):
+        merged = os.path.join(self.path, "manifest.jsonl")
+        index_path = os.path.join(self.path, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                return collections.OrderedDict((get_record_key(entry['fields']), (entry['fields'], entry['ranges']))
+                    for entry in json.load(f))
+        # A manifest from before index.json is indexed from its records.
+        return collections.OrderedDict((key, (json.loads(key), ranges))
+            for key, ranges in (read_record_ranges(merged) if os.path.exists(merged) else {}).items())
+
+    @staticmethod
+    def merge_segments(index, segments):
+        for path in segments:
+            if os.path.exists(get_ranges_path(path)):
+                with open(get_ranges_path(path)) as f:
+                    segment_ranges = json.load(f)
+            else:
+                # The task is still running, or was killed before closing its segment.
+                segment_ranges = read_record_ranges(path)
+            for key, ranges in segment_ranges.items():
+                fields, existing = index.pop(key, (json.loads(key), []))
+                index[key] = (fields, merge_ranges(existing + ranges))
+        return index
+
+    def read(self, function):
+        # function(segments) on a consistent view: a fold may append segments to
+        # manifest.jsonl and remove them meanwhile, which shows as a missing segment.
+        while True:
+            try:
+                return function(self.get_segments())
+            except FileNotFoundError:
+                continue
+
+    def fold(self, write=True):
+        # Returns [(fields, ranges)] per record key, most recently written last.
+        if not os.path.isdir(self.path):
+            return []
+        if not write:
+            return list(self.read(lambda segments: self.merge_segments(self.read_index(), segments)).values())
+        merged = os.path.join(self.path, "manifest.jsonl")
+        index_path = os.path.join(self.path, "index.json")
+        with open(os.path.join(self.path, "fold.lock"), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = self.read_index()
+            segments = self.get_segments()
+            finished = [path for path in segments if not is_locked(path)]
+            if finished or (index and not os.path.exists(index_path)):
+                self.append(merged, finished)
+                self.merge_segments(index, finished)
+                write_json(index_path, [{'fields': fields, 'ranges': ranges} for fields, ranges in index.values()])
+                for path in finished:
+                    os.remove(path)
+                    if os.path.exists(get_ranges_path(path)):
+                        os.remove(get_ranges_path(path))
+            # Running tasks' records count as done without being folded yet.
+            return list(self.merge_segments(index, [path for path in segments if path not in finished]).values())
+
+    def append(self, merged, segments):
+        with open(merged, 'ab') as f:
+            # Drop a torn last line left by an interrupted fold before appending.
+            if f.tell() > 0:
+                with open(merged, 'rb') as tail:
+                    tail.seek(-1, os.SEEK_END)
+                    if tail.read(1) != b"\n":
+                        tail.seek(0)
+                        f.truncate(tail.read().rfind(b"\n") + 1)
+            for path in segments:
+                with open(path, 'rb') as segment:
+                    data = segment.read()
+                f.write(data[:data.rfind(b"\n") + 1])
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self):
+        merged = os.path.join(self.path, "manifest.jsonl")
+        def read_records(segments):
+            # A rewritten output (a regenerated shard) replaces its earlier record.
+            records = {}
+            for path in [merged] + segments:
+                if path == merged and not os.path.exists(path):
+                    continue
+                with open(path) as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue
+                        records.pop(record['path'], None)
+                        records[record['path']] = record
+            return list(records.values())
+        return self.read(read_records) if os.path.isdir(self.path) else []
+
+    def open_segment(self, start, fields=None):
+        os.makedirs(self.path, exist_ok=True)
+        return ManifestSegment(os.path.join(self.path, "segment-{}-{}-{}.jsonl".format(
+            str(start).zfill(12), os.getpid(), time.time_ns())), fields)
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def is_matching_record(record, is_normal_distribution, params, suffix, output_format):
+    return (record.get('label') == str(is_normal_distribution).lower()
+        and record.get('suffix') == suffix
+        and record.get('output_format') == output_format
+        and all(record.get(name) == value for name, value in params.items()))
+
+# Options that change what an output holds. Records carry them, so that a rerun with
+# other ones does not count the earlier outputs as done; counts hold no image.
+SAMPLING_RECORD_OPTIONS = ['sampling', 'hist_range', 'out_of_range']
+IMAGE_RECORD_OPTIONS = ['backend', 'width', 'height', 'dpi', 'axes', 'image_mode', 'compress_level', 'quality']
+
+def get_record_options(options):
+    # The values as they read back from JSON.
+    record_options = {name: options[name] for name in SAMPLING_RECORD_OPTIONS}
+    if options['hist_range'] is not None:
+        record_options['hist_range'] = [float(value) for value in options['hist_range']]
+    if options['output_format'] != 'counts':
+        record_options.update({name: options[name] for name in IMAGE_RECORD_OPTIONS})
+        record_options.update(width=int(options['width']), height=int(options['height']), dpi=float(options['dpi']),
+            axes=bool(options['axes']))
+    return record_options
+
+def get_other_options(record, options):
+    # Names of the recorded options that differ from options; records from before the
+    # options were recorded match any.
+    return sorted(name for name, value in get_record_options(options).items()
+        if name in record and record[name] != value)
+
+def is_valid_record(record):
+    path = record['path']
+    if ':' in path:
+        return os.path.exists(path.rsplit(':', 1)[0])
+    if not os.path.exists(path):
+        return False
+    with open(path, 'rb') as f:
+        return sha256(f.read()) == record['sha256']
+
+def get_pending_ranges(start, stop, completed, align=1):
+    # Maximal runs of [start, stop) that still need work, given the completed indices
+    # as a set or as sorted, disjoint [start, stop) ranges. With align > 1 (shards) a
+    # whole aligned block is pending as soon as one of its indices is missing.
+    if isinstance(completed, (set, frozenset)):
+        completed = get_index_ranges(completed)
+    pending = []
+    position = start
+    for done_start, done_stop in list(completed) + [(stop, stop)]:
+        if position >= stop:
+            break
+        if position < min(done_start, stop):
+            low = max(start, position - position % align)
+            high = min(stop, -(-min(done_start, stop) // align) * align)
+            if pending and pending[-1][1] >= low:
+                pending[-1] = (pending[-1][0], max(pending[-1][1], high))
+            else:
+                pending.append((low, high))
+        position = max(position, done_stop)
+    return pending
+
+def fsync_directory(path):
+    fd = os.open(path or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class FileWriter:
+    # Files are written under a ".part" name and renamed, so a file that exists under its
+    # final name is always complete. With write_queue > 0 the render loop only encodes:
+    # a writer thread takes the encoded images from a queue of at most write_queue
+    # entries (back-pressure), writes them in batches and, with fsync, syncs each
+    # directory once per batch instead of once per file.
+    WRITE_BATCH = 256
+
+    def __init__(self, out_path_base, suffix, options, segment=None):
+        self.out_path_base = out_path_base
+        self.suffix = suffix
+        self.options = options
+        self.segment = segment
+        self.fsync = options['fsync']
+        # Fan-out directories this process has already created.
+        self.directories = set()
+        self.error = None
+        self.queue = None
+        if int(options['write_queue']) > 0:
+            self.queue = queue.Queue(maxsize=int(options['write_queue']))
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    @staticmethod
+    def prepare(out_path_base, number, params, options):
+        pass
+
+    def write(self, index, filename, renderer, metadata):
+        with timed_stage('encode'):
+            data = renderer.encode(self.suffix, **get_encoding(self.options))
+        if self.queue is None:
+            self.store([(filename, data, metadata)])
+        else:
+            self.raise_error()
+            # Time blocked on a full queue: the disk is slower than rendering.
+            with timed_stage('write_wait'):
+                self.queue.put((filename, data, metadata))
+        return filename
+
+    def store(self, items):
+        with timed_stage('write'):
+            self.store_items(items)
+
+    def make_directory(self, directory):
+        # Every worker creates the fan-out directories it needs on first use; exist_ok
+        # covers the races between workers, so no lock is shared.
+        if directory in self.directories or not int(self.options['fanout']):
+            return
+        os.makedirs(directory, exist_ok=True)
+        if self.fsync:
+            fsync_directory(os.path.dirname(directory))
+        self.directories.add(directory)
+
+    def store_items(self, items):
+        for filename, data, _ in items:
+            self.make_directory(os.path.dirname(filename))
+            with open(filename + ".part", 'wb') as f:
+                f.write(data)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(filename + ".part", filename)
+        if self.fsync:
+            for directory in set(os.path.dirname(filename) for filename, _, _ in items):
+                fsync_directory(directory)
+        if self.segment is not None:
+            for filename, data, metadata in items:
+                self.segment.add(dict(metadata, path=filename, sha256=sha256(data), suffix=self.suffix,
+                    output_format='files'))
+
+    def run(self):
+        while True:
+            items = [self.queue.get()]
+            while items[-1] is not None and len(items) < self.WRITE_BATCH:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # After a failure keep draining so the producer never blocks on a full queue.
+            if self.error is None:
+                try:
+                    self.store([item for item in items if item is not None])
+                except Exception as e:
+                    self.error = e
+            if items[-1] is None:
+                return
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.stop()
+        self.raise_error()
+
+    def abort(self):
+        # Queued images are complete, so they are still written; a run that failed
+        # reports its own error rather than the writer's.
+        self.stop()
+
+    def stop(self):
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.queue = None
+
+class ShardWriter:
+    # Packs samples into tar shards of shard_size consecutive indices, so shard k always
+    # holds indices [k * shard_size, (k + 1) * shard_size) whichever worker wrote it. Each
+    # sample is an image member plus a JSON sidecar; shard-k.json indexes member offsets.
+    def __init__(self, out_path_base, suffix, options, segment=None):
+        self.out_path_base = out_path_base
+        self.suffix = suffix
+        self.options = options
+        self.segment = segment
+        self.shard_size = int(options['shard_size'])
+        self.shard = None
+        self.tar = None
+        self.samples = []
+        self.records = []
+
+    @staticmethod
+    def prepare(out_path_base, number, params, options):
+        pass
+
+    def get_shard_path(self, shard):
+        return "{}/shard-{}".format(self.out_path_base, str(shard).zfill(6))
+
+    def add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mode = 0o644
+        offset = self.tar.offset + len(info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors))
+        self.tar.addfile(info, io.BytesIO(data))
+        return {'name': name, 'offset': offset, 'size': info.size}
+
+    def write(self, index, filename, renderer, metadata):
+        with timed_stage('encode'):
+            data = renderer.encode(self.suffix, **get_encoding(self.options))
+        with timed_stage('write'):
+            return self.add_sample(index, filename, data, metadata)
+
+    def add_sample(self, index, filename, data, metadata):
+        shard = index // self.shard_size
+        if shard != self.shard:
+            self.close()
+            self.shard = shard
+            self.tar = tarfile.open(self.get_shard_path(shard) + ".tar.tmp", 'w', format=tarfile.USTAR_FORMAT)
+        name = os.path.basename(filename)
+        stem = name.rsplit('.', 1)[0]
+        self.samples.append({
+            'index': index,
+            'image': self.add_member(name, data),
+            'json': self.add_member(stem + ".json", json.dumps(metadata, sort_keys=True).encode()),
+        })
+        path = "{}.tar:{}".format(self.get_shard_path(shard), name)
+        self.records.append(dict(metadata, path=path, sha256=sha256(data), suffix=self.suffix, output_format='shards'))
+        return path
+
+    def close(self):
+        if self.tar is None:
+            return
+        self.tar.close()
+        path = self.get_shard_path(self.shard)
+        with open(path + ".json.tmp", 'w') as f:
+            json.dump({'shard': self.shard, 'samples': self.samples}, f)
+        os.replace(path + ".tar.tmp", path + ".tar")
+        os.replace(path + ".json.tmp", path + ".json")
+        if self.segment is not None:
+            for record in self.records:
+                self.segment.add(record)
+        self.shard = None
+        self.tar = None
+        self.samples = []
+        self.records = []
+
+    def abort(self):
+        # A run that fails mid-shard publishes nothing of that shard: the temporary
+        # files are removed and their records never reach the manifest.
+        if self.tar is None:
+            return
+        self.tar.close()
+        path = self.get_shard_path(self.shard)
+        for temporary in [path + ".tar.tmp", path + ".json.tmp"]:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        self.shard = None
+        self.tar = None
+        self.samples = []
+        self.records = []
+
+class NpyWriter:
+    # Writes rendered grayscale images into a preallocated N x H x W uint8 .npy (or
+    # N x H x ceil(W / 8) with pack_bits, 1 = ink) next to labels.npy and params.npy,
+    # all indexed by image index. prepare() allocates the arrays once; every worker then
+    # maps them and fills its own disjoint index range, so a trainer can np.load them
+    # with mmap_mode='r' and read images without decoding.
+    def __init__(self, out_path_base, suffix, options, segment=None):
+        self.out_path_base = out_path_base
+        self.pack_bits = options['pack_bits']
+        self.images = np.load(os.path.join(out_path_base, "images.npy"), mmap_mode='r+')
+        self.labels = np.load(os.path.join(out_path_base, "labels.npy"), mmap_mode='r+')
+        self.params = np.load(os.path.join(out_path_base, "params.npy"), mmap_mode='r+')
+
+    @staticmethod
+    def get_params_dtype(params):
+        def get_dtype(value):
+            if isinstance(value, str):
+                return np.dtype('U16')
+            if isinstance(value, (list, tuple)):
+                return np.dtype((np.float64, (len(value),)))
+            return np.dtype(np.int64 if isinstance(value, (int, np.integer)) else np.float64)
+        return np.dtype([(name, get_dtype(value)) for name, value in params.items()])
+
+    @staticmethod
+    def prepare(out_path_base, number, params, options):
+        height, width = get_options_renderer(options).shape
+        if options['pack_bits']:
+            width = -(-width // 8)
+        for name, dtype, shape in [
+            ("images.npy", np.dtype(np.uint8), (number, height, width)),
+            ("labels.npy", np.dtype(np.uint8), (number,)),
+            ("params.npy", NpyWriter.get_params_dtype(params), (number,)),
+        ]:
+            # An array of the right shape is kept, so nodes filling other index slices
+            # of the same dataset do not wipe each other's rows.
+            path = os.path.join(out_path_base, name)
+            replace = os.path.exists(path)
+            if replace and NpyWriter.is_array(path, dtype, shape):
+                continue
+            # The array is complete before it appears under its name. Of nodes that start
+            # together on a fresh directory, the first to link it wins and the others use
+            # that one; an array of another shape (a rerun with another -n) is replaced.
+            tmp = "{}.{}.tmp".format(path, secrets.token_hex(8))
+            np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=shape).flush()
+            if replace:
+                os.replace(tmp, path)
+                continue
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                if not NpyWriter.is_array(path, dtype, shape):
+                    raise ValueError("{} was created for another dataset; every node needs the same -n and "
+                        "image options".format(path))
+            finally:
+                os.remove(tmp)
+
+    @staticmethod
+    def is_array(path, dtype, shape):
+        existing = np.load(path, mmap_mode='r')
+        return existing.shape == shape and existing.dtype == dtype
+
+    def write(self, index, filename, renderer, metadata):
+        with timed_stage('encode'):
+            image = renderer.to_array()
+            if self.pack_bits:
+                image = np.packbits(image < 128, axis=-1)
+        with timed_stage('write'):
+            self.images[index] = image
+            self.labels[index] = metadata['label'] == 'true'
+            self.params[index] = tuple(metadata[name] for name in self.params.dtype.names)
+        return "{}/images.npy[{}]".format(self.out_path_base, index)
+
+    def close(self):
+        for array in [self.images, self.labels, self.params]:
+            array.flush()
+
+    def abort(self):
+        # Rows are written in place and each one is complete.
+        self.close()
+
+class CountsWriter:
+    # Exports bin counts instead of pixels: counts-k.npz holds indices
+    # [k * shard_size, (k + 1) * shard_size) as columns (index, label, one column per
+    # parameter, low and high of the histogram range, and all rows' counts
+    # concatenated in the smallest unsigned dtype that fits), plus the run's seed.
+    # Chunks are written as they fill, atomically, and render_counts() turns any
+    # subset back into the images the other writers produce.
+    renders_images = False
+
+    def __init__(self, out_path_base, suffix, options, segment=None):
+        self.out_path_base = out_path_base
+        self.suffix = suffix
+        self.segment = segment
+        self.chunk_size = int(options['shard_size'])
+        self.chunk = None
+        self.rows = []
+
+    @staticmethod
+    def prepare(out_path_base, number, params, options):
+        pass
+
+    def get_chunk_path(self, chunk):
+        return "{}/counts-{}.npz".format(self.out_path_base, str(chunk).zfill(6))
+
+    def write_counts(self, index, counts, edges, metadata):
+        chunk = index // self.chunk_size
+        if chunk != self.chunk:
+            self.close()
+            self.chunk = chunk
+        self.rows.append((metadata, np.asarray(counts), edges[0], edges[-1]))
+        return "{}:{}".format(self.get_chunk_path(chunk), index)
+
+    def close(self):
+        if not self.rows:
+            return
+        metadata = [row[0] for row in self.rows]
+        counts = np.concatenate([row[1] for row in self.rows])
+        columns = {
+            'index': np.array([row['index'] for row in metadata], dtype=np.int64),
+            'label': np.array([row['label'] == 'true' for row in metadata], dtype=np.uint8),
+            'seed': np.array(str(metadata[0]['seed'])),
+            'low': np.array([row[2] for row in self.rows], dtype=float),
+            'high': np.array([row[3] for row in self.rows], dtype=float),
+            'counts': counts.astype(np.min_scalar_type(int(counts.max()) if len(counts) else 0)),
+        }
+        for name in metadata[0]:
+            if name not in ['index', 'label', 'seed']:
+                columns[name] = np.array([row[name] for row in metadata])
+        path = self.get_chunk_path(self.chunk)
+        with timed_stage('write'):
+            with open(path + ".tmp", 'wb') as f:
+                np.savez_compressed(f, **columns)
+            os.replace(path + ".tmp", path)
+        if self.segment is not None:
+            for row, row_counts in zip(metadata, (row[1] for row in self.rows)):
+                self.segment.add(dict(row, path="{}:{}".format(path, row['index']),
+                    sha256=sha256(row_counts.astype(np.int64).tobytes()), suffix=self.suffix, output_format='counts'))
+        self.rows = []
+
+    def abort(self):
+        # The open chunk is only in memory; dropping it keeps a failed range from
+        # publishing a partial counts-k.npz.
+        self.rows = []
+
+def read_counts(path):
+    # The records of one counts-k.npz: the metadata of each image plus its counts and
+    # bin edges, which are exactly the edges the image was drawn with.
+    with np.load(path) as data:
+        columns = {name: data[name] for name in data.files}
+    seed = int(columns.pop('seed'))
+    counts = columns.pop('counts').astype(np.int64)
+    low, high = columns.pop('low'), columns.pop('high')
+    offsets = np.concatenate([[0], np.cumsum(columns['bins'])])
+    records = []
+    for row in range(len(columns['index'])):
+        record = {name: column[row].tolist() for name, column in columns.items()}
+        record['label'] = str(bool(record['label'])).lower()
+        record['seed'] = seed
+        record['counts'] = counts[offsets[row]:offsets[row + 1]]
+        record['edges'] = np.linspace(low[row], high[row], record['bins'] + 1)
+        records.append(record)
+    return records
+
+def get_counts_paths(paths):
+    # Files are taken as they are; directories are searched for counts-*.npz.
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(glob.glob(os.path.join(glob.escape(path), "**", "counts-*.npz"), recursive=True)))
+        else:
+            found.append(path)
+    return found
+
+WRITERS = {
+    'files': FileWriter,
+    'shards': ShardWriter,
+    'npy': NpyWriter,
+    'counts': CountsWriter,
+}
+
+def get_metadata(is_normal_distribution, index, seed, params):
+    metadata = {'label': str(is_normal_distribution).lower(), 'index': index, 'seed': seed}
+    metadata.update(params)
+    return metadata
+
+DEFAULT_OPTIONS = {
+    'backend': 'matplotlib',
+    'batch_size': 64,
+    'sampling': 'samples',
+    'hist_range': None,
+    'out_of_range': 'drop',
+    'chunk_size': 1 << 22,
+    'output_format': 'files',
+    'shard_size': 10000,
+    'pack_bits': False,
+    'manifest': None,
+    'verify_manifest': False,
+    'start': None,
+    'stop': None,
+    'write_queue': 64,
+    'fsync': False,
+    'fanout': 0,
+    # Resolve the seed and the pending index ranges and return them without generating.
+    'dry_run': False,
+    'width': 640,
+    'height': 480,
+    'dpi': 100,
+    'axes': True,
+    'image_mode': 'rgba',
+    'compress_level': None,
+    'quality': None,
+    # The command line defaults to 'rate'; library calls stay quiet unless asked.
+    'progress': 'none',
+    'progress_interval': 1.0,
+    'profile': None,
+}
+
+PROGRESS_MODES = ['rate', 'files', 'none']
+
+SAMPLING_MODES = ['samples', 'multinomial', 'streaming']
+
+def get_options(options):
+    unknown = set(options) - set(DEFAULT_OPTIONS)
+    if unknown:
+        raise ValueError("Unknown options: {}".format(", ".join(sorted(unknown))))
+    merged = dict(DEFAULT_OPTIONS)
+    merged.update(options)
+    if merged['sampling'] not in SAMPLING_MODES:
+        raise ValueError("Unknown sampling mode: {}".format(merged['sampling']))
+    if merged['output_format'] not in WRITERS:
+        raise ValueError("Unknown output format: {}".format(merged['output_format']))
+    if merged['manifest'] and merged['output_format'] == 'npy':
+        raise ValueError("A manifest cannot be used with npy output")
+    if merged['progress'] not in PROGRESS_MODES:
+        raise ValueError("Unknown progress mode: {}".format(merged['progress']))
+    if merged['image_mode'] not in IMAGE_MODES:
+        raise ValueError("Unknown image mode: {}".format(merged['image_mode']))
+    if not (int(merged['width']) > 0 and int(merged['height']) > 0 and float(merged['dpi']) > 0):
+        raise ValueError("Invalid image size: {}x{} at {} dpi".format(merged['width'], merged['height'], merged['dpi']))
+    if merged['hist_range'] is not None and not merged['hist_range'][0] < merged['hist_range'][1]:
+        raise ValueError("Invalid histogram range: {}".format(merged['hist_range']))
+    if not 0 <= int(merged['fanout']) <= 8:
+        raise ValueError("Invalid fanout: {}".format(merged['fanout']))
+    if int(merged['fanout']) and (merged['output_format'] != 'files' or not merged['manifest']):
+        raise ValueError("A fanout needs files output and a manifest, which indexes the files")
+    return merged
+
+def get_options_renderer(options):
+    return get_renderer(options['backend'], int(options['width']), int(options['height']), options['dpi'],
+        bool(options['axes']))
+
+def get_encoding(options):
+    return {name: options[name] for name in ['image_mode', 'compress_level', 'quality']}
+
+def get_batch_size(is_normal_distribution, params, options):
+    if options['sampling'] != 'samples':
+        return max(1, int(options['batch_size']))
+    sample_count = get_sample_count(is_normal_distribution, params)
+    return max(1, min(int(options['batch_size']), BATCH_SAMPLE_LIMIT // max(1, sample_count)))
+
+def histogram_batch(is_normal_distribution, seed, indices, params, options):
+    bins = params['bins']
+    sampling = options['sampling']
+    if sampling == 'samples':
+        with timed_stage('sample'):
+            rngs = [get_rng(seed, is_normal_distribution, i) for i in indices]
+            data = sample_batch(is_normal_distribution, rngs, params)
+        with timed_stage('histogram'):
+            if options['hist_range'] is None:
+                return histogram_rows(data, bins)
+            if options['out_of_range'] == 'clip':
+                np.clip(data, *options['hist_range'], out=data)
+            return histogram_rows(data, bins, *options['hist_range'])
+    with timed_stage('histogram'):
+        return histogram_counts(is_normal_distribution, seed, indices, params, options)
+
+def histogram_counts(is_normal_distribution, seed, indices, params, options):
+    # The multinomial and streaming modes, which produce bin counts without
+    # materializing the samples.
+    bins = params['bins']
+    distribution = get_distribution(is_normal_distribution, params)
+    if options['sampling'] == 'multinomial':
+        edges = np.linspace(*(options['hist_range'] or distribution.get_default_range(params)), bins + 1)
+        plan = distribution.get_multinomial_plan(params, edges)
+        counts = np.array([
+            multinomial_histogram(get_rng(seed, is_normal_distribution, i), plan, options['out_of_range'])
+            for i in indices
+        ])
+        return counts, np.broadcast_to(edges, (len(indices), bins + 1))
+    rows = [
+        stream_histogram(
+            lambda: distribution.stream(get_rng(seed, is_normal_distribution, i), params, options['chunk_size']),
+            bins, options['hist_range'], options['out_of_range'])
+        for i in indices
+    ]
+    return np.array([row[0] for row in rows]), np.array([row[1] for row in rows])
+
+def write_graph_batch(is_normal_distribution, out_path_base, number, zerofill, params, suffix, seed, indices, renderer, writer, options):
+    start = time.perf_counter()
+    counts, edges = histogram_batch(is_normal_distribution, seed, indices, params, options)
+    if not getattr(writer, 'renders_images', True):
+        with timed_stage('write'):
+            for i, row_counts, row_edges in zip(indices, counts, edges):
+                path = writer.write_counts(i, row_counts, row_edges, get_metadata(is_normal_distribution, i, seed, params))
+                if options['progress'] == 'files':
+                    print("{}/{} {}".format(i+1, number, path))
+        add_progress(len(indices), time.perf_counter() - start)
+        return
+    for i, row_counts, row_edges in zip(indices, counts, edges):
+        with timed_stage('render'):
+            renderer.draw(row_counts.astype(float), row_edges)
+
+        filename = get_output_path(is_normal_distribution, out_path_base, i, zerofill, params, suffix, seed, options)
+        path = writer.write(i, filename, renderer, get_metadata(is_normal_distribution, i, seed, params))
+        if options['progress'] == 'files':
+            print("{}/{} {}".format(i+1, number, path))
+    add_progress(len(indices), time.perf_counter() - start)
+
+def generate_graph_range(is_normal_distribution, out_path_base, number, zerofill, params, suffix, seed, start, stop, options):
+    renderer = get_options_renderer(options)
+    segment = None
+    if options['manifest']:
+        segment = Manifest(options['manifest']).open_segment(start, get_record_options(options))
+    writer = WRITERS[options['output_format']](out_path_base, suffix, options, segment)
+    batch_size = get_batch_size(is_normal_distribution, params, options)
+    try:
+        for batch_start in range(start, stop, batch_size):
+            indices = range(batch_start, min(batch_start + batch_size, stop))
+            write_graph_batch(is_normal_distribution, out_path_base, number, zerofill, params, suffix, seed,
+                indices, renderer, writer, options)
+    except BaseException:
+        writer.abort()
+        raise
+    else:
+        writer.close()
+    finally:
+        if segment is not None:
+            segment.close()
+
+def split_range(start, stop, workers, align=1):
+    # A few chunks per worker keeps the pool busy when some chunks finish early. Chunk
+    # boundaries fall on multiples of align so that no shard is split across workers.
+    chunk_size = max(1, -(-(stop - start) // (max(1, workers) * 4)))
+    chunk_size = -(-chunk_size // align) * align
+    boundaries = [start] + list(range((start // chunk_size + 1) * chunk_size, stop, chunk_size)) + [stop]
+    return [(i, j) for i, j in zip(boundaries[:-1], boundaries[1:]) if i < j]
+
+def get_write_alignment(options):
+    return int(options['shard_size']) if options['output_format'] in ['shards', 'counts'] else 1
+
+def get_index_range(number, options):
+    # The [start, stop) of a run. With shards or counts both ends must fall on a shard
+    # boundary (or stop on number), otherwise two runs would each rewrite a shared shard
+    # with only their own indices.
+    start = 0 if options['start'] is None else int(options['start'])
+    stop = number if options['stop'] is None else int(options['stop'])
+    if not 0 <= start <= stop <= number:
+        raise ValueError("Invalid index range: [{}, {}) of {}".format(start, stop, number))
+    align = get_write_alignment(options)
+    if start % align or (stop % align and stop != number):
+        raise ValueError("The index range [{}, {}) must start and stop on multiples of the shard size {} "
+            "with {} output".format(start, stop, align, options['output_format']))
+    return start, stop
+
+def resume_from_manifest(is_normal_distribution, params, suffix, seed, options):
+    # Returns the seed to use and the ranges of indices that are already done, read from
+    # the manifest's index. Without an explicit seed a rerun adopts the seed of the
+    # records it resumes.
+    entries = [
+        (fields, ranges) for fields, ranges in Manifest(options['manifest']).fold(write=not options['dry_run'])
+        if is_matching_record(fields, is_normal_distribution, params, suffix, options['output_format'])
+    ]
+    if seed is None:
+        seed = entries[-1][0]['seed'] if entries else resolve_seed(None)
+    seed = int(seed)
+    if not int(options['fanout']):
+        # In the flat layout another seed would write over these files under the same names.
+        seeds = set(fields['seed'] for fields, _ in entries) - {seed}
+        if seeds:
+            raise ValueError("{} lists images of seed {} under the same names; rerun with that seed, "
+                "another output directory or a fanout".format(options['manifest'], min(seeds)))
+    # In either layout the outputs of one seed and index share a name, so other options
+    # would mix with (and write over) the outputs already made.
+    other = sorted(set(name for fields, _ in entries if fields['seed'] == seed
+        for name in get_other_options(fields, options)))
+    if other:
+        raise ValueError("{} lists images of seed {} made with other {}; rerun with the same options or "
+            "into another output directory".format(options['manifest'], seed, ", ".join(other)))
+    if options['verify_manifest'] and not options['dry_run']:
+        # Re-hashing needs the records themselves.
+        return seed, get_index_ranges(
+            record['index'] for record in Manifest(options['manifest']).load()
+            if record['seed'] == seed and is_valid_record(record)
+            and is_matching_record(record, is_normal_distribution, params, suffix, options['output_format']))
+    return seed, merge_ranges([r for fields, ranges in entries if fields['seed'] == seed for r in ranges])
+
+def read_index(path, seed=None):
+    # {index: path} of the images of one seed (by default the last one recorded) listed
+    # in the manifest at path, without walking the output directories. It only reads,
+    # so it can run during a generation or on a read-only mount.
+    records = Manifest(path).load()
+    if not records:
+        return {}
+    seed = records[-1]['seed'] if seed is None else int(seed)
+    return {record['index']: record['path'] for record in records if record['seed'] == seed}
+
+def get_node_range(number, node, nodes, align=1):
+    # Node k of N gets a contiguous, reproducible slice of [0, number); slices start on
+    # multiples of align so that no shard is split between nodes.
+    if not 0 <= node < nodes:
+        raise ValueError("Invalid node: {}/{}".format(node, nodes))
+    blocks = -(-number // align)
+    return (min(number, blocks * node // nodes * align), min(number, blocks * (node + 1) // nodes * align))
+
+def parse_node(value):
+    try:
+        node, nodes = value.split('/')
+        return int(node), int(nodes)
+    except ValueError:
+        raise ValueError("Invalid node: {}; expected K/N".format(value))
+
+def run_graph_generation(is_normal_distribution, out_path_base, number, zerofill, params, suffix, seed, workers, options):
+    number = int(number)
+    workers = int(workers)
+    options = get_options(options)
+    start, stop = get_index_range(number, options)
+    align = get_write_alignment(options)
+    completed = []
+    if options['manifest']:
+        seed, completed = resume_from_manifest(is_normal_distribution, params, suffix, seed, options)
+    else:
+        seed = resolve_seed(seed)
+    pending = get_pending_ranges(start, stop, completed, align)
+    if options['dry_run']:
+        return {'label': str(is_normal_distribution).lower(), 'out': out_path_base, 'number': number, 'seed': seed,
+            'pending': pending}
+    WRITERS[options['output_format']].prepare(out_path_base, number, params, options)
+    if workers <= 1 or number <= 1:
+        workers = 1
+    else:
+        pending = [
+            (start, stop)
+            for pending_start, pending_stop in pending
+            for start, stop in split_range(pending_start, pending_stop, workers, align)
+        ]
+    tasks = [
+        (is_normal_distribution, out_path_base, number, zerofill, params, suffix, seed, start, stop, options)
+        for start, stop in pending
+    ]
+    stats = run_tasks(str(is_normal_distribution).lower(), generate_graph_range, tasks,
+        sum(stop - start for start, stop in pending), workers, options)
+    if int(options['fanout']):
+        # Fold the workers' segments so the index is one file when the run returns.
+        Manifest(options['manifest']).fold()
+    stats['seed'] = seed
+    return stats
+
+def get_spec_params(spec):
+    # spec uses the keyword names of generate_graphs; a 'distribution' other than
+    # 'bimodal' selects a negative class from DISTRIBUTIONS.
+    is_normal_distribution = bool(spec['is_normal_distribution'])
+    if spec.get('distribution', 'bimodal') != 'bimodal' and not is_normal_distribution:
+        params = {name: spec[name] for name in DISTRIBUTIONS[spec['distribution']].names}
+        return is_normal_distribution, dict(params, distribution=spec['distribution'])
+    return is_normal_distribution, {name: spec[name] for name in get_distribution(is_normal_distribution, {}).names}
+
+def render_batch(is_normal_distribution, params, seed, indices, options):
+    renderer = get_options_renderer(options)
+    images = np.empty((len(indices),) + renderer.shape, dtype=np.uint8)
+    batch_size = get_batch_size(is_normal_distribution, params, options)
+    for offset in range(0, len(indices), batch_size):
+        sub_indices = indices[offset:offset + batch_size]
+        counts, edges = histogram_batch(is_normal_distribution, seed, sub_indices, params, options)
+        for k, row_counts, row_edges in zip(range(offset, offset + len(sub_indices)), counts, edges):
+            renderer.draw(row_counts.astype(float), row_edges)
+            images[k] = renderer.to_array()
+    labels = np.full(len(indices), int(is_normal_distribution), dtype=np.uint8)
+    metadata = [get_metadata(is_normal_distribution, i, seed, params) for i in indices]
+    return images, labels, metadata
+
+def iter_graphs(spec, seed=None, batch_size=64, number=None, start=0, producers=1, prefetch=4, processes=False, **options):
+    # Yields (images, labels, params) batches in index order without touching the disk:
+    # images is a (batch, H, W) uint8 array, labels a (batch,) uint8 array and params a
+    # list of per-image metadata dicts. Up to prefetch batches are rendered ahead by
+    # producers background threads (or processes); number=None streams forever.
+    is_normal_distribution, params = get_spec_params(spec)
+    seed = resolve_seed(seed)
+    options = get_options(options)
+    stop = None if number is None else start + int(number)
+    batch_starts = itertools.count(start, batch_size) if stop is None else iter(range(start, stop, batch_size))
+    executor_class = concurrent.futures.ProcessPoolExecutor if processes else concurrent.futures.ThreadPoolExecutor
+    executor = executor_class(max_workers=max(1, int(producers)))
+    pending = collections.deque()
+    try:
+        while True:
+            while len(pending) < max(1, int(prefetch)):
+                batch_start = next(batch_starts, None)
+                if batch_start is None:
+                    break
+                batch_stop = batch_start + batch_size if stop is None else min(batch_start + batch_size, stop)
+                pending.append(executor.submit(render_batch, is_normal_distribution, params, seed,
+                    range(batch_start, batch_stop), options))
+            if not pending:
+                return
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+class GraphDataset:
+    # Map-style dataset: item i is rendered from (seed, i) alone, in O(1), so shuffled
+    # samplers in any number of data-loader workers can address an unbounded virtual
+    # dataset. With several specs (e.g. one per class), items cycle through them:
+    # item i is image i // len(specs) of specs[i % len(specs)]. Items are
+    # (image, label, params); the last cache_size rendered images are kept.
+    def __init__(self, specs, seed=None, length=None, cache_size=0, **options):
+        if isinstance(specs, dict):
+            specs = [specs]
+        self.specs = [get_spec_params(spec) for spec in specs]
+        self.seed = resolve_seed(seed)
+        self.length = sys.maxsize if length is None else int(length)
+        self.cache_size = int(cache_size)
+        self.cache = collections.OrderedDict()
+        self.options = get_options(options)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        index = int(index)
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("GraphDataset index out of range: {}".format(index))
+        if index in self.cache:
+            self.cache.move_to_end(index)
+            return self.cache[index]
+
+        is_normal_distribution, params = self.specs[index % len(self.specs)]
+        images, labels, metadata = render_batch(is_normal_distribution, params, self.seed,
+            range(index // len(self.specs), index // len(self.specs) + 1), self.options)
+        image = images[0]
+        image.flags.writeable = False
+        item = (image, int(labels[0]), metadata[0])
+        if self.cache_size > 0:
+            self.cache[index] = item
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return item
+
+def generate_normal_distribution_graphs(out_path_base, number, zerofill, loc, scale, size, bins, suffix, seed=None, workers=1, **options):
+    params = {'loc': loc, 'scale': scale, 'size': size, 'bins': bins}
+    return run_graph_generation(True, out_path_base, number, zerofill, params, suffix, seed, workers, options)
+
+def generate_not_normal_distribution_graphs(out_path_base, number, zerofill, loc1, loc2, scale1, scale2, size1, size2, bins, suffix, seed=None, workers=1, **options):
+    params = {'loc1': loc1, 'loc2': loc2, 'scale1': scale1, 'scale2': scale2, 'size1': size1, 'size2': size2, 'bins': bins}
+    return run_graph_generation(False, out_path_base, number, zerofill, params, suffix, seed, workers, options)
+
+def generate_distribution_graphs(out_path_base, number, zerofill, distribution, params, suffix, seed=None, workers=1, **options):
+    # Negative-class images drawn from DISTRIBUTIONS[distribution]; params holds its
+    # names, e.g. {'loc': 50.0, 'scale': 20.0, 'shape': 3.0, 'size': 1000, 'bins': 100}.
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError("Unknown distribution: {}".format(distribution))
+    params = dict({name: params[name] for name in DISTRIBUTIONS[distribution].names}, distribution=distribution)
+    return run_graph_generation(False, out_path_base, number, zerofill, params, suffix, seed, workers, options)
 
 def generate_graphs(**kwargs):
     label = str(kwargs['is_normal_distribution']).lower()
     out_path_base = "{}/{}".format(kwargs['out'], label)
-    if kwargs['is_normal_distribution']:
-        generate_normal_distribution_graphs(out_path_base, kwargs['number'], kwargs['zerofill'],
+    options = {name: kwargs[name] for name in DEFAULT_OPTIONS if name in kwargs}
+    if options.get('manifest') is True:
+        # Each node of a multi-node run keeps its own manifest, named after its slice.
+        options['manifest'] = "{}.manifest".format(out_path_base)
+        if kwargs.get('node'):
+            options['manifest'] += "." + kwargs['node']
+    if kwargs.get('distribution', 'bimodal') != 'bimodal' and not kwargs['is_normal_distribution']:
+        return generate_distribution_graphs(out_path_base, kwargs['number'], kwargs['zerofill'], kwargs['distribution'],
+            kwargs, kwargs['suffix'], kwargs.get('seed'), kwargs.get('workers', 1), **options)
+    elif kwargs['is_normal_distribution']:
+        return generate_normal_distribution_graphs(out_path_base, kwargs['number'], kwargs['zerofill'],
             kwargs['loc'], kwargs['scale'], kwargs['size'],
-            kwargs['bins'], kwargs['suffix'])
+            kwargs['bins'], kwargs['suffix'], kwargs.get('seed'), kwargs.get('workers', 1), **options)
     else:
-        generate_not_normal_distribution_graphs(out_path_base, kwargs['number'], kwargs['zerofill'],
+        return generate_not_normal_distribution_graphs(out_path_base, kwargs['number'], kwargs['zerofill'],
             kwargs['loc1'], kwargs['loc2'], kwargs['scale1'], kwargs['scale2'], kwargs['size1'], kwargs['size2'],
-            kwargs['bins'], kwargs['suffix'])
+            kwargs['bins'], kwargs['suffix'], kwargs.get('seed'), kwargs.get('workers', 1), **options)
+
+# Rough per-image render cost in units of one drawn and binned sample at 640x480.
+RENDER_COSTS = {'matplotlib': 8e6, 'raster': 3e5}
+
+def load_sweep(path):
+    with open(path) as f:
+        if path.endswith('.yaml') or path.endswith('.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("PyYAML is required to read YAML sweep specs")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+def get_default_params(is_normal_distribution, distribution=None):
+    if distribution is None or distribution == 'bimodal' or is_normal_distribution:
+        return dict(NORMAL_DISTRIBUTION_PARAMS if is_normal_distribution else NOT_NORMAL_DISTRIBUTION_PARAMS)
+    return dict(DISTRIBUTIONS[distribution].defaults, distribution=distribution)
+
+def get_param_rng(seed, is_normal_distribution, index):
+    # Parameter draws use their own stream, so they never shift the sample stream.
+    stream = 0 if is_normal_distribution else 1
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(stream, int(index), 1)))
+
+def draw_sweep_value(value, rng):
+    if 'uniform' in value:
+        return rng.uniform(*value['uniform'])
+    if 'randint' in value:
+        return rng.integers(value['randint'][0], value['randint'][1], endpoint=True)
+    if 'choice' in value:
+        return value['choice'][rng.integers(len(value['choice']))]
+    raise ValueError("Unknown sweep value: {}".format(value))
+
+def get_expected_sweep_value(value):
+    if 'uniform' in value or 'randint' in value:
+        return sum(value.get('uniform', value.get('randint'))) / 2
+    choices = value['choice']
+    if all(isinstance(choice, (int, float)) and not isinstance(choice, bool) for choice in choices):
+        return sum(choices) / len(choices)
+    # Lists (mixture locs) and strings have no mean; the first choice stands in for them.
+    return choices[0]
+
+def get_sweep_grid(class_spec):
+    # The Cartesian product of every {"grid": [...]} parameter, in spec order.
+    names = [name for name, value in class_spec['params'].items() if isinstance(value, dict) and 'grid' in value]
+    return names, list(itertools.product(*[class_spec['params'][name]['grid'] for name in names]))
+
+def get_sweep_params(class_spec, is_normal_distribution, seed, index, expected=False):
+    # Image i of N uses grid point i * G // N, so each grid point covers a contiguous
+    # index block, and draws its random parameters from (seed, i) alone.
+    defaults = get_default_params(is_normal_distribution, class_spec.get('distribution'))
+    params = dict(defaults)
+    names, points = get_sweep_grid(class_spec)
+    params.update(zip(names, points[index * len(points) // int(class_spec['number'])]))
+    rng = None if expected else get_param_rng(seed, is_normal_distribution, index)
+    for name in sorted(class_spec['params']):
+        value = class_spec['params'][name]
+        if not isinstance(value, dict):
+            params[name] = value
+        elif 'grid' not in value:
+            params[name] = get_expected_sweep_value(value) if expected else draw_sweep_value(value, rng)
+    # Keep the types of the command-line parameters so file names stay the same.
+    return {name: type(default)(params[name]) for name, default in defaults.items()}
+
+def estimate_cost(is_normal_distribution, params, options):
+    renderer = get_options_renderer(options)
+    height, width = renderer.shape
+    cost = RENDER_COSTS[options['backend']] * height * width / (640 * 480) + params['bins']
+    if options['sampling'] != 'multinomial':
+        cost += get_sample_count(is_normal_distribution, params)
+    return cost
+
+def schedule_sweep(spec, workers, options):
+    # Cuts every class into index chunks of roughly equal estimated cost (about eight per
+    # worker) and orders them most expensive first, so that cheap chunks fill in the
+    # tail instead of one large chunk finishing long after the others. Chunks never
+    # straddle a grid point, or with shards a shard boundary.
+    align = get_write_alignment(options)
+    chunks = []
+    for label, class_spec in spec['classes'].items():
+        is_normal_distribution = label == 'true'
+        number = int(class_spec['number'])
+        if number == 0:
+            continue
+        _, points = get_sweep_grid(class_spec)
+        indices = np.arange(number)
+        grid_points = indices * len(points) // number
+        point_costs = np.zeros(len(points))
+        for g, first in zip(*np.unique(grid_points, return_index=True)):
+            point_costs[g] = estimate_cost(is_normal_distribution,
+                get_sweep_params(class_spec, is_normal_distribution, None, first, expected=True), options)
+        costs = point_costs[grid_points]
+        chunks.append((label, class_spec, indices, grid_points, costs))
+    target = sum(costs.sum() for _, _, _, _, costs in chunks) / (max(1, workers) * 8)
+
+    tasks = []
+    for label, class_spec, indices, grid_points, costs in chunks:
+        units = indices // align
+        unit_costs = np.bincount(units, weights=costs)
+        unit_keys = (np.cumsum(unit_costs) - unit_costs) // target
+        keys = unit_keys[units]
+        if align == 1:
+            keys = keys + grid_points * len(indices)
+        cuts = np.flatnonzero(np.diff(keys)) + 1
+        for start, stop in zip(np.concatenate([[0], cuts]), np.concatenate([cuts, [len(indices)]])):
+            tasks.append((float(costs[start:stop].sum()), label, int(start), int(stop)))
+    tasks.sort(key=lambda task: -task[0])
+    return tasks
+
+def generate_sweep_range(is_normal_distribution, class_spec, out_path_base, zerofill, suffix, seed, start, stop, options):
+    renderer = get_options_renderer(options)
+    writer = WRITERS[options['output_format']](out_path_base, suffix, options)
+    number = int(class_spec['number'])
+    try:
+        # Consecutive images with the same parameters (grid-only sweeps) share a batch.
+        batch, batch_params = [], None
+        for i in range(start, stop):
+            params = get_sweep_params(class_spec, is_normal_distribution, seed, i)
+            if batch and (params != batch_params or len(batch) >= get_batch_size(is_normal_distribution, params, options)):
+                write_graph_batch(is_normal_distribution, out_path_base, number, zerofill, batch_params, suffix, seed,
+                    batch, renderer, writer, options)
+                batch = []
+            batch.append(i)
+            batch_params = params
+        if batch:
+            write_graph_batch(is_normal_distribution, out_path_base, number, zerofill, batch_params, suffix, seed,
+                batch, renderer, writer, options)
+    except BaseException:
+        writer.abort()
+        raise
+    else:
+        writer.close()
+
+def run_sweep(spec, out, zerofill, suffix, seed=None, workers=1, **options):
+    # spec: {"seed": ..., "classes": {"true": {"number": N, "params": {...}}, "false": ...}}
+    # where a parameter is a value, {"grid": [...]}, {"uniform": [low, high]},
+    # {"randint": [low, high]} or {"choice": [...]}; omitted parameters keep their
+    # command-line defaults. All classes run in one process pool.
+    seed = resolve_seed(spec.get('seed', seed))
+    options = get_options(options)
+    if options['manifest']:
+        raise ValueError("A manifest cannot be used with a sweep")
+    out_path_bases = {label: "{}/{}".format(out, label) for label in spec['classes']}
+    for label, class_spec in spec['classes'].items():
+        params = get_sweep_params(class_spec, label == 'true', seed, 0) if int(class_spec['number']) else {}
+        WRITERS[options['output_format']].prepare(out_path_bases[label], int(class_spec['number']), params, options)
+    tasks = [
+        (label == 'true', spec['classes'][label], out_path_bases[label], zerofill, suffix, seed, start, stop, options)
+        for _, label, start, stop in schedule_sweep(spec, workers, options)
+    ]
+    stats = run_tasks('sweep', generate_sweep_range, tasks, sum(task[7] - task[6] for task in tasks), workers, options)
+    stats['seed'] = seed
+    return stats
+
+def is_selected_record(label, index, labels, start, stop):
+    return ((labels is None or label in labels)
+        and (start is None or index >= start)
+        and (stop is None or index < stop))
+
+def render_counts_chunk(path, out, zerofill, suffix, labels, start, stop, options):
+    renderer = get_options_renderer(options)
+    writers = {}
+    try:
+        for record in read_counts(path):
+            index = record['index']
+            if not is_selected_record(record['label'], index, labels, start, stop):
+                continue
+            begin = time.perf_counter()
+            is_normal_distribution = record['label'] == 'true'
+            out_path_base = "{}/{}".format(out, record['label'])
+            if record['label'] not in writers:
+                os.makedirs(out_path_base, exist_ok=True)
+                writers[record['label']] = WRITERS[options['output_format']](out_path_base, suffix, options)
+            params = {name: value for name, value in record.items()
+                if name not in ['label', 'index', 'seed', 'counts', 'edges']}
+            with timed_stage('render'):
+                renderer.draw(record['counts'].astype(float), record['edges'])
+            filename = get_output_path(is_normal_distribution, out_path_base, index, zerofill, params, suffix,
+                record['seed'], options)
+            path = writers[record['label']].write(index, filename, renderer,
+                get_metadata(is_normal_distribution, index, record['seed'], params))
+            if options['progress'] == 'files':
+                print(path)
+            add_progress(1, time.perf_counter() - begin)
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        raise
+    else:
+        for writer in writers.values():
+            writer.close()
+
+def render_counts(paths, out, zerofill, suffix, labels=None, start=None, stop=None, workers=1, **options):
+    # Renders the records of counts-K.npz files (or of directories holding them) with
+    # labels in labels and indices in [start, stop) to OUT/LABEL, with the same file
+    # names, and from the same counts and edges, as a direct run would. Each chunk is
+    # one work item, so chunks render in parallel.
+    options = get_options(options)
+    if options['output_format'] != 'files':
+        raise ValueError("Counts can only be rendered to files")
+    paths = get_counts_paths(paths)
+    total = 0
+    for path in paths:
+        with np.load(path) as data:
+            total += sum(is_selected_record(str(bool(label)).lower(), index, labels, start, stop)
+                for label, index in zip(data['label'].tolist(), data['index'].tolist()))
+    tasks = [(path, out, zerofill, suffix, labels, start, stop, options) for path in paths]
+    return run_tasks('render', render_counts_chunk, tasks, total, workers, options)
+
+def sample_reference(is_normal_distribution, rng, params):
+    # The unbatched samples of the original pipeline. Distributions of the registry
+    # have no older path and draw from their sampler with one generator.
+    if params.get('distribution', 'bimodal') != 'bimodal' and not is_normal_distribution:
+        return get_distribution(is_normal_distribution, params).sample([rng], params)[0]
+    if is_normal_distribution:
+        return sample_normal_distribution(rng, params['loc'], params['scale'], params['size'])
+    return sample_not_normal_distribution(rng, params['loc1'], params['loc2'], params['scale1'], params['scale2'],
+        params['size1'], params['size2'])
+
+def render_reference(data, bins, options):
+    # A fresh figure and Axes.hist for every image, as plt.hist and savefig drew them,
+    # read back as the grayscale pixels the renderers' to_array() returns.
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    dpi = options['dpi']
+    figure = Figure(figsize=(int(options['width']) / dpi, int(options['height']) / dpi), dpi=dpi)
+    FigureCanvasAgg(figure)
+    figure.patch.set_facecolor('white')
+    if options['axes']:
+        axes = figure.add_subplot()
+    else:
+        axes = figure.add_axes((0, 0, 1, 1))
+        axes.set_axis_off()
+    axes.hist(data, bins=bins, range=options['hist_range'], color='black')
+    figure.canvas.draw()
+    return to_grayscale(np.asarray(figure.canvas.buffer_rgba()))
+
+def box_mean(image, size):
+    # Mean of every size x size window that fits in image, from its integral image.
+    integral = np.pad(image.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    return (integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size]
+        + integral[:-size, :-size]) / (size * size)
+
+def ssim(a, b, size=7):
+    # Mean structural similarity of two 8-bit grayscale images over uniform size x size
+    # windows (Wang et al. 2004); 1.0 for identical images.
+    a = a.astype(float)
+    b = b.astype(float)
+    mean_a, mean_b = box_mean(a, size), box_mean(b, size)
+    var_a = box_mean(a * a, size) - mean_a ** 2
+    var_b = box_mean(b * b, size) - mean_b ** 2
+    covariance = box_mean(a * b, size) - mean_a * mean_b
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    return float(np.mean((2 * mean_a * mean_b + c1) * (2 * covariance + c2)
+        / ((mean_a ** 2 + mean_b ** 2 + c1) * (var_a + var_b + c2))))
+
+# Gray levels two pixels may differ by before they count as different; anti-aliased
+# edges that move by a fraction of a pixel stay below it.
+PIXEL_DIFF_THRESHOLD = 64
+
+# Sampling modes that replay the samples of the reference, so their counts must match
+# exactly. multinomial draws the counts from their distribution instead.
+VERIFY_SAMPLING_MODES = ['samples', 'streaming']
+
+def verify_range(is_normal_distribution, class_spec, seed, start, stop, checks, options):
+    # Checks images [start, stop) of one class and returns the number checked and the
+    # failures: the counts and edges of every sampling mode against np.histogram of the
+    # reference samples, and the pixels every backend draws from those counts against
+    # the reference figure.
+    failures = []
+    for i in range(start, stop):
+        begin = time.perf_counter()
+        params = get_sweep_params(class_spec, is_normal_distribution, seed, i)
+        failure = {'label': str(is_normal_distribution).lower(), 'index': i, 'seed': seed, 'params': params}
+        with timed_stage('sample'):
+            data = sample_reference(is_normal_distribution, get_rng(seed, is_normal_distribution, i), params)
+            if options['hist_range'] is not None and options['out_of_range'] == 'clip':
+                np.clip(data, *options['hist_range'], out=data)
+        with timed_stage('histogram'):
+            counts, edges = np.histogram(data, bins=params['bins'],
+                range=options['hist_range'] or (data.min(), data.max()))
+            for sampling in checks['sampling_modes']:
+                actual_counts, actual_edges = histogram_batch(is_normal_distribution, seed, [i], params,
+                    dict(options, sampling=sampling))
+                if not (np.array_equal(actual_counts[0], counts) and np.array_equal(actual_edges[0], edges)):
+                    failures.append(dict(failure, check="counts:{}".format(sampling),
+                        mismatched_bins=int(np.sum(actual_counts[0] != counts))))
+        with timed_stage('render'):
+            expected = render_reference(data, params['bins'], options) if checks['backends'] else None
+            for backend in checks['backends']:
+                renderer = get_renderer(backend, int(options['width']), int(options['height']), options['dpi'],
+                    bool(options['axes']))
+                renderer.draw(counts.astype(float), edges)
+                image = renderer.to_array()
+                pixel_diff = float(np.mean(np.abs(image.astype(int) - expected) > PIXEL_DIFF_THRESHOLD))
+                similarity = ssim(image, expected)
+                if pixel_diff > checks['max_diff'] or similarity < checks['min_ssim']:
+                    failures.append(dict(failure, check="image:{}".format(backend), pixel_diff=pixel_diff,
+                        ssim=similarity))
+        add_progress(1, time.perf_counter() - begin)
+    return stop - start, failures
+
+def verify_graphs(spec, seed=None, workers=1, sampling_modes=None, backends=None, max_diff=0.01, min_ssim=0.95,
+        **options):
+    # Compares the fast paths with the original per-image pipeline over the images of a
+    # sweep spec (see run_sweep). A backend fails an image when more than max_diff of
+    # its pixels differ by over PIXEL_DIFF_THRESHOLD gray levels, or its SSIM is below
+    # min_ssim. Returns the run's statistics with the number of images checked and the
+    # failures, each with its label, index, seed and parameters.
+    seed = resolve_seed(spec.get('seed', seed))
+    options = get_options(options)
+    checks = {
+        'sampling_modes': VERIFY_SAMPLING_MODES if sampling_modes is None else list(sampling_modes),
+        'backends': sorted(RENDERERS) if backends is None else list(backends),
+        'max_diff': float(max_diff),
+        'min_ssim': float(min_ssim),
+    }
+    for sampling in checks['sampling_modes']:
+        if sampling not in VERIFY_SAMPLING_MODES:
+            raise ValueError("Cannot verify the counts of sampling mode: {}".format(sampling))
+    for backend in checks['backends']:
+        if backend not in RENDERERS:
+            raise ValueError("Unknown backend: {}".format(backend))
+    tasks = [
+        (label == 'true', class_spec, seed, start, stop, checks, options)
+        for label, class_spec in spec['classes'].items()
+        for start, stop in split_range(0, int(class_spec['number']), workers)
+    ]
+    results = []
+    stats = run_tasks('verify', verify_range, tasks, sum(task[4] - task[3] for task in tasks), workers, options,
+        results)
+    failures = [failure for _, task_failures in results for failure in task_failures]
+    stats.update(seed=seed, checked=sum(checked for checked, _ in results),
+        failures=sorted(failures, key=lambda failure: (failure['label'], failure['index'], failure['check'])))
+    return stats
+
+def merge_manifests(paths, out=None, number=None):
+    # Combines per-node manifests into one index sorted by (label, index). Returns the
+    # number of records, the missing index ranges per label and the indices recorded
+    # more than once with different outputs.
+    records = {}
+    duplicates = []
+    for path in paths:
+        for record in Manifest(path).load():
+            key = (record['label'], record['index'])
+            if key in records and (records[key]['path'], records[key]['sha256']) != (record['path'], record['sha256']):
+                duplicates.append(key)
+            records[key] = record
+    gaps = {}
+    for label in sorted(set(label for label, _ in records)):
+        indices = set(index for record_label, index in records if record_label == label)
+        gaps[label] = get_pending_ranges(0, max(indices) + 1 if number is None else int(number), indices)
+    if out is not None:
+        with open(out + ".tmp", 'w') as f:
+            for key in sorted(records):
+                f.write(json.dumps(records[key], sort_keys=True) + "\n")
+        os.replace(out + ".tmp", out)
+    return {'records': len(records), 'gaps': gaps, 'duplicates': sorted(set(duplicates))}
+
+def get_merge_args(argv):
+    argparser = argparse.ArgumentParser(prog="normal_distribution_graph_generator.py merge",
+        description="Merge per-node manifests into one index and check it for gaps and duplicates")
+    argparser.add_argument('manifests', nargs='+', help="Manifest directories")
+    argparser.add_argument('-o', '--out', default=None, help="Path to the merged JSONL index")
+    argparser.add_argument('-n', '--number', default=None, help="Expected number of images per label")
+    return argparser.parse_args(argv)
+
+def merge(argv):
+    args = get_merge_args(argv)
+    report = merge_manifests(args.manifests, args.out, args.number)
+    print("{} records".format(report['records']))
+    for label, gaps in report['gaps'].items():
+        for start, stop in gaps:
+            print("gap: {} [{}, {})".format(label, start, stop))
+    for label, index in report['duplicates']:
+        print("duplicate: {} {}".format(label, index))
+    return 1 if report['duplicates'] or any(report['gaps'].values()) else 0
+
+def add_image_arguments(argparser):
+    # Rendering, encoding and reporting options shared by generation and render.
+    argparser.add_argument('--backend', default='matplotlib', choices=sorted(RENDERERS),
+        help="Histogram renderer (matplotlib, raster)")
+    argparser.add_argument('--width', default=640, help="Image width in pixels")
+    argparser.add_argument('--height', default=480, help="Image height in pixels")
+    argparser.add_argument('--dpi', default=100, help="Dots per inch; sets the size of ticks and labels")
+    argparser.add_argument('--no-axes', action='store_true', help="Draw only the bars, filling the whole image")
+    argparser.add_argument('--image-mode', default='rgba', choices=IMAGE_MODES,
+        help="rgba: matplotlib's RGBA output; gray: 8-bit grayscale; 1bit: black and white (png, tiff)")
+    argparser.add_argument('--compress-level', default=None,
+        help="zlib level 0-9 for png; above 0 compresses tiff (deflate, or group 4 for 1bit)")
+    argparser.add_argument('--quality', default=None, help="JPEG quality 1-95")
+    argparser.add_argument('--progress', default='rate', choices=PROGRESS_MODES,
+        help="rate: a status line with rate, ETA and worker utilization on stderr; files: one line per image")
+    argparser.add_argument('--progress-interval', default=1.0, help="Seconds between status lines")
+    argparser.add_argument('--stats-json', default=None, metavar='PATH',
+        help="Write images/sec, utilization and seconds per stage of every run to PATH")
+    argparser.add_argument('--profile', default=None, metavar='DIR', help="Write a cProfile of every worker to DIR")
+
+def get_image_options(args):
+    return {
+        'backend': args.backend,
+        'width': int(args.width),
+        'height': int(args.height),
+        'dpi': float(args.dpi),
+        'axes': not args.no_axes,
+        'image_mode': args.image_mode,
+        'compress_level': None if args.compress_level is None else int(args.compress_level),
+        'quality': None if args.quality is None else int(args.quality),
+        'progress': args.progress,
+        'progress_interval': float(args.progress_interval),
+        'profile': args.profile,
+    }
+
+def get_render_args(argv):
+    argparser = argparse.ArgumentParser(prog="normal_distribution_graph_generator.py render",
+        description="Render images from the bin counts of an --output-format counts run")
+    argparser.add_argument('counts', nargs='+', help="counts-K.npz files, or directories to search for them")
+    argparser.add_argument('-o', '--out', default="var/data/out/is_normal_distribution", help="Path to output")
+    argparser.add_argument('-z', '--zerofill', default=4)
+    argparser.add_argument('-f', '--format', default='png', help="The format of output images")
+    argparser.add_argument('-w', '--workers', default=1, help="The number of worker processes")
+    argparser.add_argument('--label', default=None, action='append', choices=['true', 'false'],
+        help="Render only this label (repeatable)")
+    argparser.add_argument('--start', default=None, help="First index to render")
+    argparser.add_argument('--stop', default=None, help="Index to stop before")
+    add_image_arguments(argparser)
+    return argparser.parse_args(argv)
+
+def render(argv):
+    args = get_render_args(argv)
+    stats = render_counts(args.counts, args.out, int(args.zerofill), args.format, args.label,
+        None if args.start is None else int(args.start), None if args.stop is None else int(args.stop),
+        int(args.workers), **get_image_options(args))
+    write_stats(args.stats_json, [stats])
+    return 0
+
+def get_verify_args(argv):
+    argparser = argparse.ArgumentParser(prog="normal_distribution_graph_generator.py verify",
+        description="Check that the fast sampling and rendering paths reproduce the original matplotlib pipeline")
+    argparser.add_argument('-n', '--number', default=1000, help="Images per class to check without --sweep")
+    argparser.add_argument('--sweep', default=None, metavar='SPEC', help="JSON or YAML sweep of the parameters to check")
+    argparser.add_argument('--seed', default=None, help="Root seed")
+    argparser.add_argument('-w', '--workers', default=1, help="The number of worker processes")
+    argparser.add_argument('--sampling-modes', default=",".join(VERIFY_SAMPLING_MODES),
+        help="Comma-separated sampling modes whose counts must match exactly (empty: none)")
+    argparser.add_argument('--backends', default=",".join(sorted(RENDERERS)),
+        help="Comma-separated backends whose images are compared (empty: none)")
+    argparser.add_argument('--max-diff', default=0.01,
+        help="Share of pixels allowed to differ by more than {} gray levels".format(PIXEL_DIFF_THRESHOLD))
+    argparser.add_argument('--min-ssim', default=0.95, help="Lowest SSIM allowed")
+    argparser.add_argument('--range', nargs=2, default=None, metavar=('LOW', 'HIGH'), help="Fixed histogram range")
+    argparser.add_argument('--out-of-range', default='drop', choices=['drop', 'clip'])
+    argparser.add_argument('--chunk-size', default=1 << 22, help="Samples per chunk in streaming mode")
+    argparser.add_argument('--width', default=640, help="Image width in pixels")
+    argparser.add_argument('--height', default=480, help="Image height in pixels")
+    argparser.add_argument('--dpi', default=100, help="Dots per inch")
+    argparser.add_argument('--no-axes', action='store_true', help="Draw only the bars, filling the whole image")
+    argparser.add_argument('--progress', default='rate', choices=PROGRESS_MODES)
+    argparser.add_argument('--progress-interval', default=1.0, help="Seconds between status lines")
+    argparser.add_argument('--profile', default=None, metavar='DIR', help="Write a cProfile of every worker to DIR")
+    argparser.add_argument('--report', default=None, metavar='PATH', help="Write the statistics and failures to PATH")
+    return argparser.parse_args(argv)
+
+def verify(argv):
+    args = get_verify_args(argv)
+    if args.sweep is not None:
+        spec = load_sweep(args.sweep)
+    else:
+        spec = {'classes': {label: {'number': int(args.number), 'params': {}} for label in ['true', 'false']}}
+    stats = verify_graphs(spec, args.seed, int(args.workers),
+        [mode for mode in args.sampling_modes.split(',') if mode],
+        [backend for backend in args.backends.split(',') if backend],
+        float(args.max_diff), float(args.min_ssim),
+        hist_range=None if args.range is None else (float(args.range[0]), float(args.range[1])),
+        out_of_range=args.out_of_range, chunk_size=int(args.chunk_size), width=int(args.width),
+        height=int(args.height), dpi=float(args.dpi), axes=not args.no_axes, progress=args.progress,
+        progress_interval=float(args.progress_interval), profile=args.profile)
+    for failure in stats['failures']:
+        details = {name: value for name, value in failure.items()
+            if name not in ['label', 'index', 'seed', 'params', 'check']}
+        print("FAIL {} {} {}: {} {}".format(failure['check'], failure['label'], failure['index'],
+            " ".join("{}={:.4g}".format(name, value) for name, value in sorted(details.items())),
+            json.dumps(failure['params'], sort_keys=True)))
+    print("seed: {}, {} images checked, {} failures".format(stats['seed'], stats['checked'], len(stats['failures'])))
+    write_stats(args.report, [stats])
+    return 1 if stats['failures'] else 0
+
+def write_stats(path, runs):
+    if path is None:
+        return
+    with open(path, 'w') as f:
+        json.dump({'runs': runs}, f, indent=2, sort_keys=True)
+
+class GenerationRequestHandler(http.server.BaseHTTPRequestHandler):
+    # POST /generate takes the keyword arguments of generate_graphs as a JSON object and
+    # answers with the statistics of the run. Missing class parameters and options fall
+    # back to the defaults and to the options the server was started with; workers is
+    # always the size of the server's pool. GET /health reports the pool size.
+    def do_GET(self):
+        if self.path != '/health':
+            return self.send_json(404, {'error': "Not found: {}".format(self.path)})
+        self.send_json(200, {'status': 'ok', 'workers': self.server.pool.workers})
+
+    # Keyword arguments of generate_graphs besides the options and class parameters.
+    FIELDS = {'is_normal_distribution', 'out', 'number', 'zerofill', 'suffix', 'seed', 'node', 'distribution', 'workers'}
+
+    def get_unknown_fields(self, request):
+        names = set(DEFAULT_OPTIONS) | self.FIELDS
+        for distribution in DISTRIBUTIONS.values():
+            names.update(distribution.names)
+        return sorted(set(request) - names)
+
+    def do_POST(self):
+        if self.path != '/generate':
+            return self.send_json(404, {'error': "Not found: {}".format(self.path)})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(request, dict) or 'is_normal_distribution' not in request:
+                raise ValueError("Expected a JSON object with is_normal_distribution")
+            # A misspelt parameter would otherwise be ignored and its default used.
+            unknown = self.get_unknown_fields(request)
+            if unknown:
+                raise ValueError("Unknown fields: {}".format(", ".join(unknown)))
+            kwargs = {'zerofill': 4, 'suffix': 'png', 'number': 1}
+            kwargs.update(get_default_params(request['is_normal_distribution'], request.get('distribution')))
+            kwargs.update(self.server.options)
+            kwargs.update(request)
+            kwargs['workers'] = self.server.pool.workers
+            stats = generate_graphs(**kwargs)
+        except KeyError as e:
+            return self.send_json(400, {'error': "Missing field: {}".format(e)})
+        except (TypeError, ValueError, OSError) as e:
+            return self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            return self.send_json(500, {'error': "{}: {}".format(type(e).__name__, e)})
+        with self.server.runs_lock:
+            self.server.runs.append(stats)
+            write_stats(self.server.stats_json, self.server.runs)
+        self.send_json(200, stats)
+
+    def send_json(self, status, body):
+        data = (json.dumps(body, sort_keys=True) + "\n").encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket peers have no address.
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def make_server(address, pool, options, stats_json=None):
+    # address is a (host, port) pair, or the path of a Unix socket.
+    if isinstance(address, str):
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            os.remove(address)
+        server = UnixHTTPServer(address, GenerationRequestHandler)
+    else:
+        server = http.server.ThreadingHTTPServer(address, GenerationRequestHandler)
+    server.pool = pool
+    server.options = options
+    server.stats_json = stats_json
+    server.runs = []
+    server.runs_lock = threading.Lock()
+    return server
+
+def get_serve_args(argv):
+    argparser = argparse.ArgumentParser(prog="normal_distribution_graph_generator.py serve",
+        description="Keep a pool of warm workers and generate images on request over HTTP")
+    argparser.add_argument('--host', default="127.0.0.1", help="Address to listen on")
+    argparser.add_argument('--port', default=8765, help="Port to listen on")
+    argparser.add_argument('--socket', default=None, metavar='PATH', help="Listen on a Unix socket instead")
+    argparser.add_argument('-w', '--workers', default=1, help="The number of worker processes")
+    add_image_arguments(argparser)
+    return argparser.parse_args(argv)
+
+def serve(argv):
+    args = get_serve_args(argv)
+    options = get_image_options(args)
+    get_options(options)
+    pool = WorkerPool(int(args.workers), options)
+    install_worker_pool(pool)
+    address = args.socket if args.socket is not None else (args.host, int(args.port))
+    server = make_server(address, pool, options, args.stats_json)
+    print("serving on {} with {} workers".format(
+        args.socket or "http://{}:{}".format(*server.server_address[:2]), pool.workers), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        install_worker_pool(None)
+        pool.shutdown()
+        if args.socket is not None:
+            os.remove(args.socket)
+    return 0
+
+def print_plan(label, out_path_base, number, pending, options):
+    ranges = ", ".join("[{}, {})".format(start, stop) for start, stop in pending[:4])
+    if len(pending) > 4:
+        ranges += " and {} more ranges".format(len(pending) - 4)
+    print("{}: {} images {} of {} -> {} ({}, {}, {}x{} {})".format(label, sum(stop - start for start, stop in pending),
+        ranges or "(none)", number, out_path_base, options['output_format'], options['backend'], options['width'],
+        options['height'], options['image_mode']))
 
 def get_args():
     argparser = argparse.ArgumentParser()
@@ -67,27 +2545,140 @@ def get_args():
     argparser.add_argument('--scale2', default=20.0)
     argparser.add_argument('--size1', default=500)
     argparser.add_argument('--size2', default=500)
+    argparser.add_argument('--distribution', default='bimodal', choices=sorted(set(DISTRIBUTIONS) - {'normal'}),
+        help="Distribution of the not-normal graphs; all but bimodal and mixture use --loc, --scale and --size")
+    argparser.add_argument('--shape', default=None,
+        help="Skewness (skewnormal), degrees of freedom (student_t) or log sigma (lognormal)")
+    argparser.add_argument('--locs', default="25,50,75", help="Comma-separated mixture component locations")
+    argparser.add_argument('--scales', default="10,10,10", help="Comma-separated mixture component scales")
+    argparser.add_argument('--weights', default="0.3,0.4,0.3", help="Comma-separated mixture component weights")
+    argparser.add_argument('--seed', default=None, help="Root seed; image i is reproducible from (seed, i)")
+    argparser.add_argument('-w', '--workers', default=1, help="The number of worker processes")
+    argparser.add_argument('--batch-size', default=64, help="The number of images sampled and binned together")
+    argparser.add_argument('--sampling', default='samples', choices=SAMPLING_MODES,
+        help="samples: draw every sample; multinomial: draw bin counts over a fixed range; "
+            "streaming: draw samples in chunks of --chunk-size")
+    argparser.add_argument('--range', nargs=2, default=None, metavar=('LOW', 'HIGH'),
+        help="Fixed histogram range (default: data range, or 5 sigma for multinomial)")
+    argparser.add_argument('--out-of-range', default='drop', choices=['drop', 'clip'],
+        help="Samples outside --range are dropped or counted in the edge bins")
+    argparser.add_argument('--chunk-size', default=1 << 22, help="Samples per chunk in streaming mode")
+    argparser.add_argument('--output-format', default='files', choices=sorted(WRITERS),
+        help="files: one image per file; shards: tar shards of images and JSON sidecars; "
+            "npy: memory-mapped images.npy, labels.npy and params.npy; "
+            "counts: chunked counts-K.npz of bin counts and parameters, see the render command")
+    argparser.add_argument('--shard-size', default=10000, help="Samples per shard or counts chunk")
+    argparser.add_argument('--pack-bits', action='store_true', help="Store npy images as 1-bit packed rows")
+    argparser.add_argument('--no-manifest', action='store_true',
+        help="Do not keep OUT/LABEL.manifest; without it reruns start again from index 0")
+    argparser.add_argument('--verify-manifest', action='store_true',
+        help="Re-hash files listed in the manifest and regenerate missing or damaged ones")
+    argparser.add_argument('--shard', default=None, metavar='K/N',
+        help="Generate only node K's slice of N (0-based); requires --seed")
+    argparser.add_argument('--start', default=None, help="First index to generate")
+    argparser.add_argument('--stop', default=None, help="Index to stop before")
+    argparser.add_argument('--write-queue', default=64,
+        help="Encoded images waiting for the writer thread per worker (0: write synchronously)")
+    argparser.add_argument('--fsync', action='store_true', help="fsync files and, once per write batch, directories")
+    argparser.add_argument('--fanout', default=0,
+        help="Spread files over this many levels of 256 hashed subdirectories, indexed by the manifest")
+    argparser.add_argument('--sweep', default=None, metavar='SPEC',
+        help="JSON or YAML parameter sweep to run instead of a single parameter point")
+    argparser.add_argument('--dry-run', action='store_true',
+        help="Check the options and print what would be generated, without generating")
+    add_image_arguments(argparser)
     return argparser.parse_args()
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ['merge']:
+        sys.exit(merge(sys.argv[2:]))
+    if sys.argv[1:2] == ['render']:
+        sys.exit(render(sys.argv[2:]))
+    if sys.argv[1:2] == ['serve']:
+        sys.exit(serve(sys.argv[2:]))
+    if sys.argv[1:2] == ['verify']:
+        sys.exit(verify(sys.argv[2:]))
+
     args = get_args()
 
     number = int(args.number)
     out = args.out
-    zerofill = args.zerofill
+    zerofill = int(args.zerofill)
+    workers = int(args.workers)
+    options = {
+        'batch_size': int(args.batch_size),
+        'sampling': args.sampling,
+        'hist_range': None if args.range is None else (float(args.range[0]), float(args.range[1])),
+        'out_of_range': args.out_of_range,
+        'chunk_size': int(args.chunk_size),
+        'output_format': args.output_format,
+        'shard_size': int(args.shard_size),
+        'pack_bits': args.pack_bits,
+        'manifest': not args.no_manifest and args.output_format != 'npy',
+        'verify_manifest': args.verify_manifest,
+        'start': None if args.start is None else int(args.start),
+        'stop': None if args.stop is None else int(args.stop),
+        'write_queue': int(args.write_queue),
+        'fsync': args.fsync,
+        'fanout': int(args.fanout),
+    }
+    options.update(get_image_options(args))
+    try:
+        checked = get_options(options)
+    except ValueError as e:
+        sys.exit(str(e))
+    runs = []
+    if args.sweep is not None:
+        if args.shard is not None or args.start is not None or args.stop is not None:
+            sys.exit("--sweep cannot be combined with --shard, --start or --stop")
+        spec = load_sweep(args.sweep)
+        options.update(manifest=None, start=None, stop=None)
+        seed = resolve_seed(spec.get('seed', args.seed))
+        print("seed: {}".format(seed))
+        if args.dry_run:
+            for label, class_spec in spec['classes'].items():
+                number = int(class_spec['number'])
+                print_plan(label, "{}/{}".format(spec.get('out', out), label), number, [(0, number)], options)
+            sys.exit(0)
+        try:
+            runs.append(run_sweep(spec, spec.get('out', out), zerofill, spec.get('format', args.format), seed, workers,
+                **options))
+        except ValueError as e:
+            sys.exit(str(e))
+        write_stats(args.stats_json, runs)
+        sys.exit(0)
 
+    # Check the index range before anything loads numpy.
+    node = None
+    try:
+        if args.shard is not None:
+            align = get_write_alignment(options)
+            options['start'], options['stop'] = get_node_range(number, *parse_node(args.shard), align=align)
+            node = "{}-of-{}".format(*parse_node(args.shard))
+        else:
+            get_index_range(number, checked)
+    except ValueError as e:
+        sys.exit(str(e))
+    if node is None and (args.start is not None or args.stop is not None):
+        node = "{}-{}".format(options['start'] or 0, number if options['stop'] is None else options['stop'])
+    if node is not None and args.seed is None:
+        sys.exit("--seed is required when generating a slice of the index space")
+    # Without --seed a manifest run reuses the seed recorded by the run it resumes.
+    seed = args.seed if args.seed is not None or options['manifest'] else resolve_seed(None)
+    classes = []
     if args.type in ['1', 'both']:
         loc = float(args.loc)
         scale = float(args.scale)
         size = int(args.size)
         bins = int(args.bins)
         suffix = args.format
-        generate_graphs(is_normal_distribution=True,
+        classes.append(dict(is_normal_distribution=True,
             out=out,
             zerofill=zerofill,
             number=number,
             loc=loc, scale=scale, size=size,
-            bins=bins, suffix=suffix)
+            bins=bins, suffix=suffix,
+            seed=seed, workers=workers, node=node, **options))
     if args.type in ['2', 'both']:
         loc1 = float(args.loc1)
         scale1 = float(args.scale1)
@@ -96,11 +2687,40 @@ if __name__ == "__main__":
         scale2 = float(args.scale2)
         size2 = int(args.size2)
         bins = int(args.bins)
-        suffix = args.format    
-        generate_graphs(is_normal_distribution=False,
+        suffix = args.format
+        distribution = args.distribution
+        shape = DISTRIBUTIONS[distribution].defaults.get('shape') if args.shape is None else float(args.shape)
+        classes.append(dict(is_normal_distribution=False,
             number=number,
             out=out,
             zerofill=zerofill,
             loc1=loc1, scale1=scale1, size1=size1,
             loc2=loc2, scale2=scale2, size2=size2,
-            bins=bins, suffix=suffix)
+            distribution=distribution,
+            loc=float(args.loc), scale=float(args.scale), size=int(args.size), shape=shape,
+            locs=[float(value) for value in args.locs.split(',')],
+            scales=[float(value) for value in args.scales.split(',')],
+            weights=[float(value) for value in args.weights.split(',')],
+            bins=bins, suffix=suffix,
+            seed=seed, workers=workers, node=node, **options))
+    # Resolve each class's seed and pending ranges first, so that the seed a manifest
+    # run resumes with is printed before any image is drawn.
+    try:
+        plans = [generate_graphs(**dict(kwargs, dry_run=True)) for kwargs in classes]
+    except ValueError as e:
+        sys.exit(str(e))
+    if len(set(plan['seed'] for plan in plans)) == 1:
+        print("seed: {}".format(plans[0]['seed']))
+    else:
+        for plan in plans:
+            print("seed ({}): {}".format(plan['label'], plan['seed']))
+    if args.dry_run:
+        for plan in plans:
+            print_plan(plan['label'], plan['out'], number, plan['pending'], options)
+        sys.exit(0)
+    try:
+        for kwargs, plan in zip(classes, plans):
+            runs.append(generate_graphs(**dict(kwargs, seed=plan['seed'])))
+    except ValueError as e:
+        sys.exit(str(e))
+    write_stats(args.stats_json, runs)
@@ -9,6 +9,20 @@ import random
 import unittest
 from bin.normal_distribution_graph_generator import *
 import argparse
+import contextlib
+import json
+import tarfile
+import io
+import subprocess
+import sys
+import threading
+import urllib.error
+import urllib.request
+from unittest import mock
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
 
 OUT_PATH_BASE = "var/tests/data/out/is_normal_distribution"
 OUT_PATH_OF_NORMAL_DISTRIBUTION = "{}/{}_loc{}_scale{}_size{}_bins{}.{}"
@@ -422,6 +436,1062 @@ class NotNormalDistributionGraphGeneratorTest(unittest.TestCase):
         mimetype = magic.from_file(out, mime=True)
         self.assertEqual(mimetype, 'image/tiff')
 
+class ParallelGraphGenerationTest(unittest.TestCase):
+    def setUp(self) -> None:
+        for name in ['workers1', 'workers3']:
+            os.makedirs("/".join([OUT_PATH_BASE, name]), exist_ok=True)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        for name in ['workers1', 'workers3']:
+            shutil.rmtree("/".join([OUT_PATH_BASE, name]))
+        return super().tearDown()
+
+    def assert_same_files(self, dir1, dir2, number) -> None:
+        names = sorted(os.listdir(dir1))
+        self.assertEqual(len(names), number)
+        self.assertEqual(names, sorted(os.listdir(dir2)))
+        for name in names:
+            self.assertTrue(filecmp.cmp(os.path.join(dir1, name), os.path.join(dir2, name), shallow=False))
+
+    def test_generate_normal_distribution_graphs_is_independent_of_workers(self) -> None:
+        dir1 = "/".join([OUT_PATH_BASE, "workers1"])
+        dir3 = "/".join([OUT_PATH_BASE, "workers3"])
+        generate_normal_distribution_graphs(dir1, 5, 4, 50.0, 20.0, 1000, 100, 'png', seed=1234, workers=1)
+        generate_normal_distribution_graphs(dir3, 5, 4, 50.0, 20.0, 1000, 100, 'png', seed=1234, workers=3)
+        self.assert_same_files(dir1, dir3, 5)
+
+    def test_generate_not_normal_distribution_graphs_is_independent_of_workers(self) -> None:
+        dir1 = "/".join([OUT_PATH_BASE, "workers1"])
+        dir3 = "/".join([OUT_PATH_BASE, "workers3"])
+        generate_not_normal_distribution_graphs(dir1, 5, 4, 25.0, 75.0, 20.0, 20.0, 500, 500, 100, 'png', seed=1234, workers=1)
+        generate_not_normal_distribution_graphs(dir3, 5, 4, 25.0, 75.0, 20.0, 20.0, 500, 500, 100, 'png', seed=1234, workers=3)
+        self.assert_same_files(dir1, dir3, 5)
+
+    def test_get_rng_depends_on_seed_label_and_index(self) -> None:
+        self.assertEqual(get_rng(1, True, 7).random(), get_rng(1, True, 7).random())
+        self.assertNotEqual(get_rng(1, True, 7).random(), get_rng(1, True, 8).random())
+        self.assertNotEqual(get_rng(1, True, 7).random(), get_rng(1, False, 7).random())
+        self.assertNotEqual(get_rng(1, True, 7).random(), get_rng(2, True, 7).random())
+
+class HistogramRendererTest(unittest.TestCase):
+    def render_with_pyplot(self, data, bins, suffix) -> bytes:
+        fig = plt.figure()
+        plt.hist(data, bins=bins, color='black')
+        fig.patch.set_facecolor('white')
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=suffix)
+        plt.close(fig)
+        return buffer.getvalue()
+
+    def test_renderer_matches_pyplot_hist(self) -> None:
+        renderer = HistogramRenderer()
+        for i, bins in enumerate([100, 100, 10, 100]):
+            data = get_rng(0, True, i).normal(loc=50.0, scale=20.0, size=1000)
+            for suffix in ['png', 'jpg', 'tiff']:
+                renderer.draw_data(data, bins)
+                buffer = io.BytesIO()
+                renderer.save(buffer, format=suffix)
+                self.assertEqual(buffer.getvalue(), self.render_with_pyplot(data, bins, suffix))
+
+    def test_renderer_reuses_figure_and_bars(self) -> None:
+        renderer = HistogramRenderer()
+        renderer.draw_data(get_rng(0, True, 0).normal(size=1000), 100)
+        bars = renderer.bars
+        for i in range(1, 20):
+            renderer.draw_data(get_rng(0, True, i).normal(size=1000), 100)
+        self.assertIs(renderer.bars, bars)
+        self.assertEqual(len(renderer.axes.patches), 100)
+        self.assertEqual(len(plt.get_fignums()), 0)
+
+class RasterRendererTest(unittest.TestCase):
+    def setUp(self) -> None:
+        os.makedirs("/".join([OUT_PATH_BASE, "raster"]), exist_ok=True)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree("/".join([OUT_PATH_BASE, "raster"]))
+        return super().tearDown()
+
+    def test_generate_normal_distribution_graphs_with_raster_backend(self) -> None:
+        out_dir = "/".join([OUT_PATH_BASE, "raster"])
+        for suffix, mime in [('png', 'image/png'), ('jpg', 'image/jpeg'), ('tiff', 'image/tiff')]:
+            generate_normal_distribution_graphs(out_dir, 2, 4, 50.0, 20.0, 1000, 100, suffix, seed=1, backend='raster')
+            out = OUT_PATH_OF_NORMAL_DISTRIBUTION.format(out_dir, '0001', 50.0, 20.0, 1000, 100, suffix)
+            self.assertEqual(magic.from_file(out, mime=True), mime)
+
+    def test_raster_bars_match_matplotlib_bars(self) -> None:
+        from PIL import Image
+        data = get_rng(0, True, 0).normal(loc=50.0, scale=20.0, size=1000)
+        images = []
+        for renderer in [HistogramRenderer(), RasterRenderer()]:
+            renderer.draw_data(data, 100)
+            buffer = io.BytesIO()
+            renderer.save(buffer, format='png')
+            images.append(np.asarray(Image.open(buffer).convert('L')))
+        self.assertEqual(images[0].shape, images[1].shape)
+        # Inside the axes box only bar edges may land on a neighbouring pixel.
+        inside = (slice(60, 426), slice(82, 575))
+        mismatch = np.mean(np.abs(images[0][inside].astype(int) - images[1][inside]) > 128)
+        self.assertLess(mismatch, 0.005)
+
+    def test_get_nice_ticks(self) -> None:
+        self.assertEqual(get_nice_ticks(0.0, 32.55), [0.0, 5.0, 10.0, 15.0, 20.0, 25.0, 30.0])
+        self.assertEqual(get_nice_ticks(-16.6, 129.6), [0.0, 20.0, 40.0, 60.0, 80.0, 100.0, 120.0])
+
+class BatchSamplingTest(unittest.TestCase):
+    def test_histogram_rows_matches_np_histogram(self) -> None:
+        for size in [1, 2, 7, 1000]:
+            for bins in [1, 10, 100]:
+                rngs = [get_rng(0, True, i) for i in range(8)]
+                data = sample_normal_distribution_batch(rngs, 50.0, 20.0, size)
+                data[0] = np.round(data[0])
+                counts, edges = histogram_rows(data, bins)
+                self.assertEqual(counts.shape, (8, bins))
+                for row, row_counts, row_edges in zip(data, counts, edges):
+                    expected_counts, expected_edges = np.histogram(row, bins=bins, range=(row.min(), row.max()))
+                    self.assertTrue(np.array_equal(row_counts, expected_counts))
+                    self.assertTrue(np.array_equal(row_edges, expected_edges))
+
+    def test_histogram_rows_with_fixed_range_drops_outside_samples(self) -> None:
+        data = np.random.default_rng(0).normal(size=(4, 1000))
+        counts, _ = histogram_rows(data, 20, -1.0, 1.0)
+        for row, row_counts in zip(data, counts):
+            self.assertTrue(np.array_equal(row_counts, np.histogram(row, bins=20, range=(-1.0, 1.0))[0]))
+
+    def test_batch_samples_match_single_image_samples(self) -> None:
+        rngs = [get_rng(0, True, i) for i in range(4)]
+        block = sample_normal_distribution_batch(rngs, 50.0, 20.0, 100)
+        for i, row in enumerate(block):
+            self.assertTrue(np.array_equal(row, sample_normal_distribution(get_rng(0, True, i), 50.0, 20.0, 100)))
+        rngs = [get_rng(0, False, i) for i in range(4)]
+        block = sample_not_normal_distribution_batch(rngs, 25.0, 75.0, 20.0, 10.0, 60, 40)
+        for i, row in enumerate(block):
+            expected = sample_not_normal_distribution(get_rng(0, False, i), 25.0, 75.0, 20.0, 10.0, 60, 40)
+            self.assertTrue(np.array_equal(row, expected))
+
+class HistogramSamplingModeTest(unittest.TestCase):
+    NORMAL_PARAMS = {'loc': 50.0, 'scale': 20.0, 'size': 1000, 'bins': 100}
+    NOT_NORMAL_PARAMS = {'loc1': 25.0, 'loc2': 75.0, 'scale1': 20.0, 'scale2': 20.0, 'size1': 500, 'size2': 500, 'bins': 100}
+
+    def test_streaming_matches_samples(self) -> None:
+        for is_normal_distribution, params in [(True, self.NORMAL_PARAMS), (False, self.NOT_NORMAL_PARAMS)]:
+            for hist_range in [None, (0.0, 100.0)]:
+                expected = histogram_batch(is_normal_distribution, 0, range(4), params,
+                    get_options({'hist_range': hist_range, 'out_of_range': 'clip'}))
+                actual = histogram_batch(is_normal_distribution, 0, range(4), params,
+                    get_options({'sampling': 'streaming', 'chunk_size': 77, 'hist_range': hist_range, 'out_of_range': 'clip'}))
+                self.assertTrue(np.array_equal(expected[0], actual[0]))
+                self.assertTrue(np.array_equal(expected[1], actual[1]))
+
+    def test_multinomial_handles_huge_sizes(self) -> None:
+        params = dict(self.NORMAL_PARAMS, size=10 ** 10)
+        counts, edges = histogram_batch(True, 0, range(2), params,
+            get_options({'sampling': 'multinomial', 'hist_range': (0.0, 100.0), 'out_of_range': 'clip'}))
+        self.assertEqual(counts.shape, (2, 100))
+        self.assertTrue(np.all(counts.sum(axis=1) == 10 ** 10))
+        self.assertEqual((edges[0][0], edges[0][-1]), (0.0, 100.0))
+        counts, _ = histogram_batch(True, 0, range(2), params,
+            get_options({'sampling': 'multinomial', 'hist_range': (0.0, 100.0)}))
+        self.assertTrue(np.all(counts.sum(axis=1) < 10 ** 10))
+
+    def test_get_bin_probabilities(self) -> None:
+        probabilities = get_bin_probabilities(0.0, 1.0, np.linspace(-1.0, 1.0, 3))
+        self.assertAlmostEqual(probabilities.sum(), 1.0)
+        self.assertAlmostEqual(probabilities[0], 0.15865525393145707)
+        self.assertAlmostEqual(probabilities[1], probabilities[2])
+        self.assertAlmostEqual(probabilities[0], probabilities[3])
+        tail = get_bin_probabilities(0.0, 1.0, np.array([9.0, 10.0]))
+        self.assertGreater(tail[1], 0.0)
+
+    def test_generate_normal_distribution_graphs_with_multinomial_sampling(self) -> None:
+        out_dir = "/".join([OUT_PATH_BASE, "multinomial"])
+        os.makedirs(out_dir, exist_ok=True)
+        try:
+            generate_normal_distribution_graphs(out_dir, 2, 4, 50.0, 20.0, 10 ** 9, 100, 'png', seed=0,
+                backend='raster', sampling='multinomial')
+            self.assertEqual(len(os.listdir(out_dir)), 2)
+        finally:
+            shutil.rmtree(out_dir)
+
+    def test_unknown_option_raises(self) -> None:
+        with self.assertRaises(ValueError):
+            get_options({'samplng': 'multinomial'})
+
+class ShardOutputTest(unittest.TestCase):
+    def setUp(self) -> None:
+        for name in ['shards1', 'shards3']:
+            os.makedirs("/".join([OUT_PATH_BASE, name]), exist_ok=True)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        for name in ['shards1', 'shards3']:
+            shutil.rmtree("/".join([OUT_PATH_BASE, name]))
+        return super().tearDown()
+
+    def test_generate_normal_distribution_graphs_to_shards(self) -> None:
+        out_dir = "/".join([OUT_PATH_BASE, "shards1"])
+        generate_normal_distribution_graphs(out_dir, 7, 4, 50.0, 20.0, 1000, 100, 'png', seed=5,
+            backend='raster', output_format='shards', shard_size=3)
+        self.assertEqual(sorted(os.listdir(out_dir)), [
+            'shard-000000.json', 'shard-000000.tar',
+            'shard-000001.json', 'shard-000001.tar',
+            'shard-000002.json', 'shard-000002.tar'])
+
+        with open(os.path.join(out_dir, 'shard-000001.json')) as f:
+            index = json.load(f)
+        self.assertEqual([sample['index'] for sample in index['samples']], [3, 4, 5])
+        with tarfile.open(os.path.join(out_dir, 'shard-000001.tar')) as tar:
+            self.assertEqual(tar.getnames()[:2], [
+                OUT_PATH_OF_NORMAL_DISTRIBUTION.format('', '0003', 50.0, 20.0, 1000, 100, 'png')[1:],
+                '0003_loc50.0_scale20.0_size1000_bins100.json'])
+            sidecar = json.load(tar.extractfile(tar.getmembers()[1]))
+        self.assertEqual(sidecar, {'label': 'true', 'index': 3, 'seed': 5,
+            'loc': 50.0, 'scale': 20.0, 'size': 1000, 'bins': 100})
+
+        with open(os.path.join(out_dir, 'shard-000001.tar'), 'rb') as f:
+            image = index['samples'][0]['image']
+            f.seek(image['offset'])
+            self.assertTrue(f.read(image['size']).startswith(b'\x89PNG'))
+
+    def test_shards_are_independent_of_workers(self) -> None:
+        dir1 = "/".join([OUT_PATH_BASE, "shards1"])
+        dir3 = "/".join([OUT_PATH_BASE, "shards3"])
+        generate_not_normal_distribution_graphs(dir1, 7, 4, 25.0, 75.0, 20.0, 20.0, 500, 500, 100, 'png', seed=5,
+            workers=1, backend='raster', output_format='shards', shard_size=2)
+        generate_not_normal_distribution_graphs(dir3, 7, 4, 25.0, 75.0, 20.0, 20.0, 500, 500, 100, 'png', seed=5,
+            workers=3, backend='raster', output_format='shards', shard_size=2)
+        names = sorted(os.listdir(dir1))
+        self.assertEqual(len(names), 8)
+        self.assertEqual(names, sorted(os.listdir(dir3)))
+        for name in names:
+            self.assertTrue(filecmp.cmp(os.path.join(dir1, name), os.path.join(dir3, name), shallow=False))
+
+class NpyOutputTest(unittest.TestCase):
+    def setUp(self) -> None:
+        for name in ['npy1', 'npy3']:
+            os.makedirs("/".join([OUT_PATH_BASE, name]), exist_ok=True)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        for name in ['npy1', 'npy3']:
+            shutil.rmtree("/".join([OUT_PATH_BASE, name]))
+        return super().tearDown()
+
+    def test_generate_normal_distribution_graphs_to_npy(self) -> None:
+        out_dir = "/".join([OUT_PATH_BASE, "npy1"])
+        generate_normal_distribution_graphs(out_dir, 3, 4, 50.0, 20.0, 1000, 100, 'png', seed=5, output_format='npy')
+        images = np.load(os.path.join(out_dir, "images.npy"), mmap_mode='r')
+        self.assertEqual(images.shape, (3, 480, 640))
+        self.assertEqual(images.dtype, np.uint8)
+        self.assertTrue(np.array_equal(np.load(os.path.join(out_dir, "labels.npy")), [1, 1, 1]))
+        params = np.load(os.path.join(out_dir, "params.npy"))
+        self.assertEqual(params.dtype.names, ('loc', 'scale', 'size', 'bins'))
+        self.assertEqual(params[2]['size'], 1000)
+
+        renderer = HistogramRenderer()
+        counts, edges = histogram_batch(True, 5, range(2, 3), {'loc': 50.0, 'scale': 20.0, 'size': 1000, 'bins': 100},
+            get_options({}))
+        renderer.draw(counts[0].astype(float), edges[0])
+        self.assertTrue(np.array_equal(images[2], renderer.to_array()))
+
+    def test_npy_output_is_independent_of_workers(self) -> None:
+        dir1 = "/".join([OUT_PATH_BASE, "npy1"])
+        dir3 = "/".join([OUT_PATH_BASE, "npy3"])
+        generate_not_normal_distribution_graphs(dir1, 7, 4, 25.0, 75.0, 20.0, 20.0, 500, 500, 100, 'png', seed=5,
+            workers=1, backend='raster', output_format='npy', pack_bits=True)
+        generate_not_normal_distribution_graphs(dir3, 7, 4, 25.0, 75.0, 20.0, 20.0, 500, 500, 100, 'png', seed=5,
+            workers=3, backend='raster', output_format='npy', pack_bits=True)
+        images = np.load(os.path.join(dir1, "images.npy"))
+        self.assertEqual(images.shape, (7, 480, 80))
+        self.assertTrue(np.any(images))
+        self.assertTrue(np.array_equal(images, np.load(os.path.join(dir3, "images.npy"))))
+        self.assertTrue(np.array_equal(np.load(os.path.join(dir1, "labels.npy")), np.zeros(7)))
+
+    def test_npy_prepare_keeps_the_array_of_a_node_that_started_first(self) -> None:
+        out_dir = "/".join([OUT_PATH_BASE, "npy1"])
+        params = {'loc': 50.0, 'scale': 20.0, 'size': 1000, 'bins': 100}
+        options = get_options({'backend': 'raster', 'output_format': 'npy'})
+        NpyWriter.prepare(out_dir, 4, params, options)
+        images = np.load(os.path.join(out_dir, "images.npy"), mmap_mode='r+')
+        images[1] = 7
+        images.flush()
+        # Another node checked for the arrays before the first one created them.
+        with mock.patch.object(os.path, 'exists', return_value=False):
+            NpyWriter.prepare(out_dir, 4, params, options)
+            with self.assertRaises(ValueError):
+                NpyWriter.prepare(out_dir, 5, params, options)
+        self.assertTrue(np.all(np.load(os.path.join(out_dir, "images.npy"))[1] == 7))
+        self.assertEqual(sorted(os.listdir(out_dir)), ["images.npy", "labels.npy", "params.npy"])
+
+class IterGraphsTest(unittest.TestCase):
+    SPEC = {'is_normal_distribution': False, 'loc1': 25.0, 'loc2': 75.0, 'scale1': 20.0, 'scale2': 20.0,
+        'size1': 500, 'size2': 500, 'bins': 100}
+
+    def test_iter_graphs_yields_batches_in_index_order(self) -> None:
+        batches = list(iter_graphs(self.SPEC, seed=3, batch_size=4, number=10, backend='raster'))
+        self.assertEqual([images.shape for images, _, _ in batches], [(4, 480, 640), (4, 480, 640), (2, 480, 640)])
+        self.assertEqual([params['index'] for _, _, batch in batches for params in batch], list(range(10)))
+        self.assertTrue(all(np.array_equal(labels, np.zeros(len(labels))) for _, labels, _ in batches))
+        self.assertEqual(batches[0][2][0], {'label': 'false', 'index': 0, 'seed': 3, 'loc1': 25.0, 'loc2': 75.0,
+            'scale1': 20.0, 'scale2': 20.0, 'size1': 500, 'size2': 500, 'bins': 100})
+
+    def test_iter_graphs_is_independent_of_producers(self) -> None:
+        expected = list(iter_graphs(self.SPEC, seed=3, batch_size=3, number=7, backend='raster'))
+        actual = list(iter_graphs(self.SPEC, seed=3, batch_size=3, number=7, backend='raster', producers=3, prefetch=2))
+        for (expected_images, _, _), (actual_images, _, _) in zip(expected, actual):
+            self.assertTrue(np.array_equal(expected_images, actual_images))
+
+    def test_iter_graphs_streams_until_closed(self) -> None:
+        batches = iter_graphs(self.SPEC, seed=3, batch_size=2, backend='raster', producers=2)
+        for _, (_, _, params) in zip(range(5), batches):
+            pass
+        batches.close()
+        self.assertEqual(params[-1]['index'], 9)
+
+class GraphDatasetTest(unittest.TestCase):
+    NORMAL_SPEC = {'is_normal_distribution': True, 'loc': 50.0, 'scale': 20.0, 'size': 1000, 'bins': 100}
+    NOT_NORMAL_SPEC = {'is_normal_distribution': False, 'loc1': 25.0, 'loc2': 75.0, 'scale1': 20.0, 'scale2': 20.0,
+        'size1': 500, 'size2': 500, 'bins': 100}
+
+    def test_getitem_matches_sequential_generation(self) -> None:
+        dataset = GraphDataset(self.NORMAL_SPEC, seed=3, length=100, backend='raster')
+        images, _, _ = next(iter_graphs(self.NORMAL_SPEC, seed=3, batch_size=8, number=8, backend='raster'))
+        for i in [7, 0, 5]:
+            image, label, params = dataset[i]
+            self.assertTrue(np.array_equal(image, images[i]))
+            self.assertEqual(label, 1)
+            self.assertEqual(params['index'], i)
+        self.assertEqual(len(dataset), 100)
+        self.assertEqual(dataset[-1][2]['index'], 99)
+        with self.assertRaises(IndexError):
+            dataset[100]
+
+    def test_getitem_alternates_between_specs(self) -> None:
+        dataset = GraphDataset([self.NORMAL_SPEC, self.NOT_NORMAL_SPEC], seed=3, backend='raster')
+        self.assertEqual([dataset[i][1] for i in range(4)], [1, 0, 1, 0])
+        self.assertEqual(dataset[5][2]['index'], 2)
+        self.assertEqual(dataset[5][2]['label'], 'false')
+
+    def test_getitem_uses_lru_cache(self) -> None:
+        dataset = GraphDataset(self.NORMAL_SPEC, seed=3, cache_size=2, backend='raster')
+        first = dataset[0]
+        self.assertIs(dataset[0], first)
+        dataset[1]
+        dataset[2]
+        self.assertEqual(list(dataset.cache), [1, 2])
+        self.assertIsNot(dataset[0], first)
+        self.assertTrue(np.array_equal(dataset[0][0], first[0]))
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self) -> None:
+        for name in ['resumed', 'fresh']:
+            os.makedirs("/".join([OUT_PATH_BASE, name]), exist_ok=True)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        for name in ['resumed', 'fresh', 'resumed.manifest']:
+            shutil.rmtree("/".join([OUT_PATH_BASE, name]), ignore_errors=True)
+        return super().tearDown()
+
+    def generate(self, name, number, **options) -> None:
+        generate_normal_distribution_graphs("/".join([OUT_PATH_BASE, name]), number, 4, 50.0, 20.0, 1000, 100, 'png',
+            backend='raster', **options)
+
+    def test_rerun_generates_only_the_new_tail(self) -> None:
+        manifest = "/".join([OUT_PATH_BASE, "resumed.manifest"])
+        self.generate('resumed', 3, seed=9, manifest=manifest)
+        first = OUT_PATH_OF_NORMAL_DISTRIBUTION.format("/".join([OUT_PATH_BASE, "resumed"]), '0000', 50.0, 20.0, 1000, 100, 'png')
+        os.remove(first)
+        self.generate('resumed', 6, manifest=manifest, workers=2)
+        self.assertFalse(os.path.exists(first))
+        self.assertEqual(len(os.listdir("/".join([OUT_PATH_BASE, "resumed"]))), 5)
+
+        records = Manifest(manifest).load()
+        self.assertEqual(sorted(record['index'] for record in records), list(range(6)))
+        # Reading leaves the segments of the last run in place; the next run folds them.
+        self.assertTrue([name for name in os.listdir(manifest) if name.startswith('segment-')])
+        Manifest(manifest).fold()
+        self.assertEqual(sorted(os.listdir(manifest)), ['fold.lock', 'index.json', 'manifest.jsonl'])
+        self.assertEqual(Manifest(manifest).load(), records)
+        self.assertEqual(set(record['seed'] for record in records), {9})
+
+        self.generate('fresh', 6, seed=9)
+        for name in os.listdir("/".join([OUT_PATH_BASE, "resumed"])):
+            self.assertTrue(filecmp.cmp("/".join([OUT_PATH_BASE, "resumed", name]), "/".join([OUT_PATH_BASE, "fresh", name]),
+                shallow=False))
+
+    def test_verify_manifest_regenerates_missing_files(self) -> None:
+        manifest = "/".join([OUT_PATH_BASE, "resumed.manifest"])
+        self.generate('resumed', 3, seed=9, manifest=manifest)
+        first = OUT_PATH_OF_NORMAL_DISTRIBUTION.format("/".join([OUT_PATH_BASE, "resumed"]), '0000', 50.0, 20.0, 1000, 100, 'png')
+        os.remove(first)
+        with open(os.path.join(manifest, "segment-torn.jsonl"), 'w') as f:
+            f.write('{"index": 1, "lab')
+        self.generate('resumed', 3, manifest=manifest, verify_manifest=True)
+        self.assertTrue(os.path.exists(first))
+        self.assertEqual(len(Manifest(manifest).load()), 3)
+
+    def test_shards_resume_whole_shards(self) -> None:
+        manifest = "/".join([OUT_PATH_BASE, "resumed.manifest"])
+        self.generate('resumed', 4, seed=9, manifest=manifest, output_format='shards', shard_size=3)
+        self.generate('resumed', 7, manifest=manifest, output_format='shards', shard_size=3)
+        self.generate('fresh', 7, seed=9, output_format='shards', shard_size=3)
+        for name in os.listdir("/".join([OUT_PATH_BASE, "fresh"])):
+            self.assertTrue(filecmp.cmp("/".join([OUT_PATH_BASE, "resumed", name]), "/".join([OUT_PATH_BASE, "fresh", name]),
+                shallow=False))
+        self.assertEqual(len(Manifest(manifest).load()), 7)
+
+    def test_shard_ranges_must_be_aligned(self) -> None:
+        manifest = "/".join([OUT_PATH_BASE, "resumed.manifest"])
+        for start, stop in [(5, 15), (0, 5), (10, 15)]:
+            with self.assertRaises(ValueError):
+                self.generate('resumed', 20, seed=9, manifest=manifest, output_format='shards', shard_size=10,
+                    start=start, stop=stop)
+        self.generate('resumed', 25, seed=9, manifest=manifest, output_format='shards', shard_size=10, start=10,
+            stop=25)
+        self.assertEqual(sorted(os.listdir("/".join([OUT_PATH_BASE, "resumed"]))),
+            ["shard-000001.json", "shard-000001.tar", "shard-000002.json", "shard-000002.tar"])
+
+    def test_failed_shard_is_not_published(self) -> None:
+        import bin.normal_distribution_graph_generator as generator
+        manifest = "/".join([OUT_PATH_BASE, "resumed.manifest"])
+        def failing_get_metadata(is_normal_distribution, index, seed, params):
+            if index == 3:
+                raise RuntimeError("failed at 3")
+            return get_metadata(is_normal_distribution, index, seed, params)
+        with mock.patch.object(generator, 'get_metadata', failing_get_metadata):
+            with self.assertRaises(RuntimeError):
+                self.generate('resumed', 10, seed=9, manifest=manifest, output_format='shards', shard_size=10)
+        self.assertEqual(os.listdir("/".join([OUT_PATH_BASE, "resumed"])), [])
+        self.assertEqual(Manifest(manifest).load(), [])
+
+    def test_command_line_prints_resumed_seed_and_plan(self) -> None:
+        def run(*args):
+            return subprocess.run([sys.executable, 'bin/normal_distribution_graph_generator.py', '-t', '1',
+                '-o', "/".join([OUT_PATH_BASE, 'resumed']), '--backend', 'raster', '--width', '64', '--height', '64',
+                '--progress', 'none'] + list(args), stdout=subprocess.PIPE, check=True).stdout.decode().splitlines()
+        os.makedirs("/".join([OUT_PATH_BASE, 'resumed', 'true']))
+        self.assertEqual(run('-n', '3', '--seed', '9')[0], "seed: 9")
+        output = run('-n', '6', '--dry-run')
+        self.assertEqual(output[0], "seed: 9")
+        self.assertTrue(output[1].startswith("true: 3 images [3, 6) of 6"))
+        self.assertEqual(len(os.listdir("/".join([OUT_PATH_BASE, 'resumed', 'true']))), 3)
+        self.assertEqual(run('-n', '6'), ["seed: 9"])
+        self.assertEqual(len(os.listdir("/".join([OUT_PATH_BASE, 'resumed', 'true']))), 6)
+
+    def test_command_line_reports_invalid_input(self) -> None:
+        def run(*args):
+            return subprocess.run([sys.executable, 'bin/normal_distribution_graph_generator.py', '-t', '1',
+                '-o', "/".join([OUT_PATH_BASE, 'resumed']), '--backend', 'raster', '--width', '64', '--height', '64',
+                '--progress', 'none'] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        os.makedirs("/".join([OUT_PATH_BASE, 'resumed', 'true']))
+        self.assertEqual(run('-n', '2', '--seed', '9').returncode, 0)
+        for args, message in [
+            (['-n', '5', '--start', '7'], "Invalid index range: [7, 5) of 5"),
+            (['-n', '5', '--shard', '3/3', '--seed', '9'], "Invalid node: 3/3"),
+            (['-n', '2', '--seed', '10'], "lists images of seed 9 under the same names"),
+        ]:
+            result = run(*args)
+            self.assertEqual(result.returncode, 1)
+            self.assertIn(message, result.stderr.decode())
+            self.assertNotIn("Traceback", result.stderr.decode())
+
+    def test_rerun_with_other_options_is_refused(self) -> None:
+        def run(*args):
+            return subprocess.run([sys.executable, 'bin/normal_distribution_graph_generator.py', '-t', '1',
+                '-o', "/".join([OUT_PATH_BASE, 'resumed']), '--backend', 'raster', '--progress', 'none', '--seed', '1']
+                + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        os.makedirs("/".join([OUT_PATH_BASE, 'resumed', 'true']))
+        self.assertEqual(run('-n', '3').returncode, 0)
+        for args, message in [
+            (['-n', '3', '--width', '64', '--height', '64'], "made with other height, width"),
+            (['-n', '6', '--sampling', 'multinomial'], "made with other sampling"),
+        ]:
+            result = run(*args)
+            self.assertEqual(result.returncode, 1)
+            self.assertIn(message, result.stderr.decode())
+        self.assertEqual(len(os.listdir("/".join([OUT_PATH_BASE, 'resumed', 'true']))), 3)
+        self.assertEqual(run('-n', '4').returncode, 0)
+        self.assertEqual(len(os.listdir("/".join([OUT_PATH_BASE, 'resumed', 'true']))), 4)
+
+    def test_fold_keeps_running_segments(self) -> None:
+        manifest = "/".join([OUT_PATH_BASE, "resumed.manifest"])
+        self.generate('resumed', 2, seed=9, manifest=manifest)
+        record = Manifest(manifest).load()[0]
+        # Another task is still writing while a run folds the manifest.
+        segment = Manifest(manifest).open_segment(2)
+        segment.add(dict(record, index=2, path="2.png"))
+        self.assertEqual([ranges for _, ranges in Manifest(manifest).fold()], [[[0, 3]]])
+        segment.add(dict(record, index=3, path="3.png"))
+        segment.close()
+        self.assertEqual([ranges for _, ranges in Manifest(manifest).fold()], [[[0, 4]]])
+        self.assertEqual(sorted(record['index'] for record in Manifest(manifest).load()), [0, 1, 2, 3])
+        self.assertEqual(sorted(os.listdir(manifest)), ['fold.lock', 'index.json', 'manifest.jsonl'])
+
+    def test_resume_reads_only_the_index(self) -> None:
+        import bin.normal_distribution_graph_generator as generator
+        manifest = "/".join([OUT_PATH_BASE, "resumed.manifest"])
+        for stop in [2, 5]:
+            self.generate('resumed', 8, seed=9, manifest=manifest, stop=stop, workers=2)
+        # Segments of the last run are appended on the next fold.
+        self.assertEqual([ranges for _, ranges in Manifest(manifest).fold()], [[[0, 5]]])
+        merged = os.path.join(manifest, "manifest.jsonl")
+        with open(merged) as f:
+            self.assertEqual(len(f.readlines()), 5)
+        with open(os.path.join(manifest, "index.json")) as f:
+            self.assertEqual([entry['ranges'] for entry in json.load(f)], [[[0, 5]]])
+        # A killed task leaves a segment without ranges, ending in a torn line.
+        with open(os.path.join(manifest, "segment-killed.jsonl"), 'w') as f:
+            with open(merged) as records:
+                record = json.loads(records.readline())
+            f.write(json.dumps(dict(record, index=6)) + "\n" + json.dumps(dict(record, index=7))[:20])
+        with mock.patch.object(generator.Manifest, 'load', side_effect=AssertionError("records were read")):
+            seed, completed = resume_from_manifest(True, {'loc': 50.0, 'scale': 20.0, 'size': 1000, 'bins': 100},
+                'png', None, get_options({'backend': 'raster', 'manifest': manifest}))
+        self.assertEqual((seed, completed), (9, [[0, 5], [6, 7]]))
+        with open(merged) as f:
+            self.assertEqual(len(f.readlines()), 6)
+        self.assertEqual(get_pending_ranges(0, 8, completed), [(5, 6), (7, 8)])
+        self.assertEqual(get_pending_ranges(3, 8, [[0, 5], [6, 7]], 4), [(4, 8)])
+
+    def test_get_pending_ranges(self) -> None:
+        self.assertEqual(get_pending_ranges(0, 10, {0, 1, 4, 5, 9}), [(2, 4), (6, 9)])
+        self.assertEqual(get_pending_ranges(0, 10, {0, 1, 2, 4, 5}, 3), [(3, 10)])
+        self.assertEqual(get_pending_ranges(0, 10, {0, 1, 2, 6, 7, 8}, 3), [(3, 6), (9, 10)])
+        self.assertEqual(get_pending_ranges(0, 3, {0, 1, 2}), [])
+
+class MultiNodeGenerationTest(unittest.TestCase):
+    def setUp(self) -> None:
+        for name in ['nodes', 'single']:
+            os.makedirs("/".join([OUT_PATH_BASE, name]), exist_ok=True)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        for name in os.listdir(OUT_PATH_BASE):
+            if name.startswith('nodes') or name.startswith('single'):
+                shutil.rmtree("/".join([OUT_PATH_BASE, name]))
+        return super().tearDown()
+
+    def test_get_node_range(self) -> None:
+        self.assertEqual([get_node_range(10, k, 3) for k in range(3)], [(0, 3), (3, 6), (6, 10)])
+        self.assertEqual([get_node_range(10, k, 3, align=4) for k in range(3)], [(0, 4), (4, 8), (8, 10)])
+        self.assertEqual([get_node_range(2, k, 3) for k in range(3)], [(0, 0), (0, 1), (1, 2)])
+        with self.assertRaises(ValueError):
+            get_node_range(10, 3, 3)
+
+    def test_node_slices_match_single_node_run_and_merge(self) -> None:
+        nodes_dir = "/".join([OUT_PATH_BASE, "nodes"])
+        manifests = []
+        for node in range(3):
+            start, stop = get_node_range(10, node, 3)
+            manifests.append("{}.manifest.{}-of-3".format(nodes_dir, node))
+            generate_normal_distribution_graphs(nodes_dir, 10, 4, 50.0, 20.0, 1000, 100, 'png', seed=4,
+                backend='raster', start=start, stop=stop, manifest=manifests[-1])
+        single_dir = "/".join([OUT_PATH_BASE, "single"])
+        generate_normal_distribution_graphs(single_dir, 10, 4, 50.0, 20.0, 1000, 100, 'png', seed=4, backend='raster')
+        self.assertEqual(sorted(os.listdir(nodes_dir)), sorted(os.listdir(single_dir)))
+        for name in os.listdir(single_dir):
+            self.assertTrue(filecmp.cmp(os.path.join(nodes_dir, name), os.path.join(single_dir, name), shallow=False))
+
+        index = "/".join([OUT_PATH_BASE, "nodes.jsonl"])
+        report = merge_manifests(manifests, index, 10)
+        self.assertEqual(report, {'records': 10, 'gaps': {'true': []}, 'duplicates': []})
+        with open(index) as f:
+            self.assertEqual([json.loads(line)['index'] for line in f], list(range(10)))
+        os.remove(index)
+
+        report = merge_manifests([manifests[0], manifests[2]], number=12)
+        self.assertEqual(report['gaps'], {'true': [(3, 6), (10, 12)]})
+
+    def test_merge_detects_duplicates(self) -> None:
+        nodes_dir = "/".join([OUT_PATH_BASE, "nodes"])
+        for seed in [1, 2]:
+            generate_normal_distribution_graphs(nodes_dir, 2, 4, 50.0, 20.0, 1000, 100, 'png', seed=seed,
+                backend='raster', manifest="{}.manifest.{}".format(nodes_dir, seed))
+        report = merge_manifests(["{}.manifest.{}".format(nodes_dir, seed) for seed in [1, 2]])
+        self.assertEqual(report['duplicates'], [('true', 0), ('true', 1)])
+
+class AsyncWriterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        for name in ['sync', 'async']:
+            os.makedirs("/".join([OUT_PATH_BASE, name]), exist_ok=True)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        for name in ['sync', 'async']:
+            shutil.rmtree("/".join([OUT_PATH_BASE, name]))
+        return super().tearDown()
+
+    def test_async_writer_matches_synchronous_writes(self) -> None:
+        sync_dir = "/".join([OUT_PATH_BASE, "sync"])
+        async_dir = "/".join([OUT_PATH_BASE, "async"])
+        generate_normal_distribution_graphs(sync_dir, 6, 4, 50.0, 20.0, 1000, 100, 'png', seed=2,
+            backend='raster', write_queue=0)
+        generate_normal_distribution_graphs(async_dir, 6, 4, 50.0, 20.0, 1000, 100, 'png', seed=2,
+            backend='raster', write_queue=2, fsync=True)
+        self.assertEqual(sorted(os.listdir(sync_dir)), sorted(os.listdir(async_dir)))
+        self.assertEqual(len(os.listdir(async_dir)), 6)
+        for name in os.listdir(sync_dir):
+            self.assertTrue(filecmp.cmp(os.path.join(sync_dir, name), os.path.join(async_dir, name), shallow=False))
+
+    def test_async_writer_raises_write_errors(self) -> None:
+        missing_dir = "/".join([OUT_PATH_BASE, "async", "missing"])
+        with self.assertRaises(FileNotFoundError):
+            generate_normal_distribution_graphs(missing_dir, 3, 4, 50.0, 20.0, 1000, 100, 'png', seed=2,
+                backend='raster', write_queue=1)
+
+class SweepTest(unittest.TestCase):
+    SPEC = {'seed': 7, 'classes': {
+        'true': {'number': 12, 'params': {'size': {'grid': [100, 10000]}, 'loc': {'uniform': [40, 60]}, 'scale': 10}},
+        'false': {'number': 5, 'params': {'loc2': {'grid': [60, 80]}, 'bins': {'randint': [20, 40]}}},
+    }}
+
+    def tearDown(self) -> None:
+        for name in ['sweep1', 'sweep3']:
+            shutil.rmtree("/".join([OUT_PATH_BASE, name]), ignore_errors=True)
+        return super().tearDown()
+
+    def test_get_sweep_params(self) -> None:
+        class_spec = self.SPEC['classes']['true']
+        self.assertEqual([get_sweep_params(class_spec, True, 7, i)['size'] for i in [0, 5, 6, 11]], [100, 100, 10000, 10000])
+        params = get_sweep_params(class_spec, True, 7, 3)
+        self.assertEqual(params, get_sweep_params(class_spec, True, 7, 3))
+        self.assertTrue(40 <= params['loc'] <= 60)
+        self.assertEqual((params['scale'], params['bins']), (10.0, 100))
+        self.assertIsInstance(params['scale'], float)
+        params = get_sweep_params(self.SPEC['classes']['false'], False, 7, 4)
+        self.assertEqual(params['loc2'], 80.0)
+        self.assertTrue(20 <= params['bins'] <= 40)
+
+    def test_schedule_sweep_with_list_choices(self) -> None:
+        spec = {'seed': 7, 'classes': {'false': {'number': 6, 'distribution': 'mixture', 'params': {
+            'locs': {'choice': [[20.0, 50.0, 80.0], [30.0, 60.0, 90.0]]}, 'size': {'choice': [500, 1500]}}}}}
+        tasks = schedule_sweep(spec, 2, get_options({'backend': 'raster'}))
+        self.assertEqual(sorted(index for _, _, start, stop in tasks for index in range(start, stop)), list(range(6)))
+        params = get_sweep_params(spec['classes']['false'], False, 7, 0, expected=True)
+        self.assertEqual((params['locs'], params['size']), ([20.0, 50.0, 80.0], 1000))
+        self.assertIn(get_sweep_params(spec['classes']['false'], False, 7, 0)['locs'], spec['classes']['false']['params']['locs']['choice'])
+
+    def test_schedule_sweep_covers_every_index_once_most_expensive_first(self) -> None:
+        for options in [{'backend': 'raster'}, {'backend': 'raster', 'output_format': 'shards', 'shard_size': 4}]:
+            tasks = schedule_sweep(self.SPEC, 2, get_options(options))
+            self.assertEqual([cost for cost, _, _, _ in tasks], sorted([cost for cost, _, _, _ in tasks], reverse=True))
+            for label, class_spec in self.SPEC['classes'].items():
+                covered = sorted(i for _, task_label, start, stop in tasks if task_label == label for i in range(start, stop))
+                self.assertEqual(covered, list(range(class_spec['number'])))
+        tasks = schedule_sweep(self.SPEC, 2, get_options({'backend': 'raster', 'output_format': 'shards', 'shard_size': 4}))
+        self.assertTrue(all(start % 4 == 0 for _, _, start, _ in tasks))
+
+    def test_run_sweep_is_independent_of_workers(self) -> None:
+        for name, workers in [('sweep1', 1), ('sweep3', 3)]:
+            for label in ['true', 'false']:
+                os.makedirs("/".join([OUT_PATH_BASE, name, label]), exist_ok=True)
+            run_sweep(self.SPEC, "/".join([OUT_PATH_BASE, name]), 4, 'png', workers=workers, backend='raster')
+        for label, number in [('true', 12), ('false', 5)]:
+            names = sorted(os.listdir("/".join([OUT_PATH_BASE, 'sweep1', label])))
+            self.assertEqual(len(names), number)
+            self.assertEqual(names, sorted(os.listdir("/".join([OUT_PATH_BASE, 'sweep3', label]))))
+            for name in names:
+                self.assertTrue(filecmp.cmp("/".join([OUT_PATH_BASE, 'sweep1', label, name]),
+                    "/".join([OUT_PATH_BASE, 'sweep3', label, name]), shallow=False))
+
+class DistributionTest(unittest.TestCase):
+    def setUp(self) -> None:
+        os.makedirs("/".join([OUT_PATH_BASE, 'dist1']), exist_ok=True)
+        os.makedirs("/".join([OUT_PATH_BASE, 'dist3']), exist_ok=True)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree("/".join([OUT_PATH_BASE, 'dist1']))
+        shutil.rmtree("/".join([OUT_PATH_BASE, 'dist3']))
+        return super().tearDown()
+
+    def get_params(self, name, size):
+        params = dict(DISTRIBUTIONS[name].defaults, size=size)
+        if name in ['normal', 'bimodal']:
+            return params
+        return dict(params, distribution=name)
+
+    def test_streams_match_batch_samples(self) -> None:
+        for name in DISTRIBUTIONS:
+            if name == 'bimodal':
+                continue
+            params = self.get_params(name, 1000)
+            distribution = get_distribution(name == 'normal', params)
+            block = distribution.sample([get_rng(0, name == 'normal', i) for i in range(3)], params)
+            self.assertEqual(block.shape, (3, 1000))
+            for i, row in enumerate(block):
+                chunks = list(distribution.stream(get_rng(0, name == 'normal', i), params, 300))
+                self.assertTrue(np.array_equal(np.concatenate(chunks), row), name)
+
+    def test_bin_probabilities_match_samples(self) -> None:
+        for name in ['mixture', 'skewnormal', 'student_t', 'uniform', 'lognormal']:
+            params = self.get_params(name, 200000)
+            distribution = get_distribution(False, params)
+            edges = np.linspace(*distribution.get_default_range(params), 21)
+            (size, probabilities), = distribution.get_multinomial_plan(params, edges)
+            self.assertEqual(size, 200000)
+            self.assertAlmostEqual(probabilities.sum(), 1.0)
+            data = distribution.sample([get_rng(0, False, 0)], params)[0]
+            counts = np.histogram(data, np.concatenate([[-np.inf], edges, [np.inf]]))[0]
+            self.assertLess(np.abs(counts / size - probabilities).max(), 0.005, name)
+
+    def test_generate_distribution_graphs_is_independent_of_workers(self) -> None:
+        params = {'locs': [20.0, 50.0, 80.0], 'scales': [5.0, 10.0, 5.0], 'weights': [1, 2, 1], 'size': 1000, 'bins': 50}
+        for name, workers in [('dist1', 1), ('dist3', 3)]:
+            generate_distribution_graphs("/".join([OUT_PATH_BASE, name]), 6, 4, 'mixture', params, 'png',
+                seed=3, workers=workers, backend='raster')
+        names = sorted(os.listdir("/".join([OUT_PATH_BASE, 'dist1'])))
+        self.assertEqual(names[0], "0000_mixture_locs20.0-50.0-80.0_scales5.0-10.0-5.0_weights1-2-1_size1000_bins50.png")
+        self.assertEqual(names, sorted(os.listdir("/".join([OUT_PATH_BASE, 'dist3']))))
+        for name in names:
+            self.assertTrue(filecmp.cmp("/".join([OUT_PATH_BASE, 'dist1', name]),
+                "/".join([OUT_PATH_BASE, 'dist3', name]), shallow=False))
+
+    def test_invalid_mixture_raises(self) -> None:
+        params = {'locs': [20.0, 80.0], 'scales': [5.0], 'weights': [1, 1], 'size': 10, 'bins': 5}
+        with self.assertRaises(ValueError):
+            generate_distribution_graphs("/".join([OUT_PATH_BASE, 'dist1']), 1, 4, 'mixture', params, 'png')
+        with self.assertRaises(ValueError):
+            generate_distribution_graphs("/".join([OUT_PATH_BASE, 'dist1']), 1, 4, 'cauchy', params, 'png')
+
+class ImageEncodingTest(unittest.TestCase):
+    def setUp(self) -> None:
+        os.makedirs("/".join([OUT_PATH_BASE, "small"]), exist_ok=True)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree("/".join([OUT_PATH_BASE, "small"]))
+        return super().tearDown()
+
+    def test_renderers_use_target_size_without_axes(self) -> None:
+        data = get_rng(0, True, 0).normal(loc=50.0, scale=20.0, size=1000)
+        for backend in ['matplotlib', 'raster']:
+            renderer = get_renderer(backend, 64, 32, 50, False)
+            self.assertIs(renderer, get_renderer(backend, 64, 32, 50, False))
+            self.assertIsNot(renderer, get_renderer(backend))
+            renderer.draw_data(data, 20)
+            image = renderer.to_array()
+            self.assertEqual(image.shape, (32, 64))
+            # The bars rise from the bottom row and there is no frame around them.
+            self.assertEqual(image[-1, 10:-10].max(), 0)
+            self.assertEqual(image[0].min(), 255)
+            self.assertEqual(image[:, 0].min(), 255)
+
+    def test_encode_gray_and_1bit(self) -> None:
+        from PIL import Image
+        for backend in ['matplotlib', 'raster']:
+            renderer = get_renderer(backend, 64, 64, 100, False)
+            renderer.draw_data(get_rng(0, True, 1).normal(size=1000), 30)
+            image = renderer.to_array()
+            for suffix, image_mode, mode in [('png', 'gray', 'L'), ('png', '1bit', '1'), ('tiff', '1bit', '1'),
+                    ('tiff', 'gray', 'L'), ('jpg', 'gray', 'L')]:
+                encoded = Image.open(io.BytesIO(renderer.encode(suffix, image_mode=image_mode, compress_level=9)))
+                self.assertEqual((encoded.mode, encoded.size), (mode, (64, 64)))
+                if mode == '1':
+                    self.assertTrue(np.array_equal(np.asarray(encoded), image >= 128))
+                elif suffix != 'jpg':
+                    self.assertTrue(np.array_equal(np.asarray(encoded), image))
+            with self.assertRaises(ValueError):
+                renderer.encode('jpg', image_mode='1bit')
+
+    def test_generate_small_grayscale_images(self) -> None:
+        from PIL import Image
+        out_dir = "/".join([OUT_PATH_BASE, "small"])
+        generate_normal_distribution_graphs(out_dir, 2, 4, 50.0, 20.0, 1000, 100, 'png', seed=1,
+            width=64, height=64, axes=False, image_mode='1bit')
+        out = OUT_PATH_OF_NORMAL_DISTRIBUTION.format(out_dir, '0001', 50.0, 20.0, 1000, 100, 'png')
+        self.assertEqual((Image.open(out).mode, Image.open(out).size), ('1', (64, 64)))
+        with self.assertRaises(ValueError):
+            generate_normal_distribution_graphs(out_dir, 1, 4, 50.0, 20.0, 1000, 100, 'png', image_mode='cmyk')
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self) -> None:
+        os.makedirs("/".join([OUT_PATH_BASE, "stats"]), exist_ok=True)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree("/".join([OUT_PATH_BASE, "stats"]))
+        return super().tearDown()
+
+    def test_generation_returns_stats(self) -> None:
+        out_dir = "/".join([OUT_PATH_BASE, "stats"])
+        for workers in [1, 2]:
+            stats = generate_normal_distribution_graphs(out_dir, 6, 4, 50.0, 20.0, 1000, 100, 'png', seed=2,
+                workers=workers, backend='raster', progress='none')
+            self.assertEqual((stats['label'], stats['images'], stats['seed'], stats['workers']), ('true', 6, 2, workers))
+            self.assertGreater(stats['images_per_sec'], 0)
+            self.assertTrue(0 < stats['utilization'] <= 1)
+            self.assertTrue({'sample', 'histogram', 'render', 'encode', 'write'} <= set(stats['stage_seconds']))
+
+    def test_progress_modes(self) -> None:
+        out_dir = "/".join([OUT_PATH_BASE, "stats"])
+        output = {}
+        for progress in ['files', 'rate', 'none']:
+            stdout, stderr = io.StringIO(), io.StringIO()
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                generate_normal_distribution_graphs(out_dir, 3, 4, 50.0, 20.0, 1000, 100, 'png', seed=2,
+                    backend='raster', progress=progress, progress_interval=60)
+            output[progress] = (stdout.getvalue().splitlines(), stderr.getvalue().splitlines())
+        self.assertEqual(len(output['files'][0]), 3)
+        self.assertEqual(output['files'][1], [])
+        self.assertEqual(output['rate'][0], [])
+        self.assertEqual(len(output['rate'][1]), 1)
+        self.assertRegex(output['rate'][1][0], r"^true: 3/3 images, [0-9.]+ images/s, ETA 0:00:00, utilization [0-9]+%$")
+        self.assertEqual(output['none'], ([], []))
+
+    def test_profile_writes_one_file_per_worker(self) -> None:
+        import pstats
+        out_dir = "/".join([OUT_PATH_BASE, "stats"])
+        profile_dir = "/".join([OUT_PATH_BASE, "stats", "profile"])
+        generate_normal_distribution_graphs(out_dir, 2, 4, 50.0, 20.0, 1000, 100, 'png', seed=2,
+            backend='raster', progress='none', profile=profile_dir)
+        self.assertEqual(os.listdir(profile_dir), ["worker-{}.prof".format(os.getpid())])
+        stats = pstats.Stats(os.path.join(profile_dir, "worker-{}.prof".format(os.getpid())))
+        self.assertTrue(any(function == 'generate_graph_range' for _, _, function in stats.stats))
+
+class CountsExportTest(unittest.TestCase):
+    def setUp(self) -> None:
+        for name in ["counts", "direct", "rendered"]:
+            os.makedirs("/".join([OUT_PATH_BASE, name]), exist_ok=True)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        for name in ["counts", "direct", "rendered"]:
+            shutil.rmtree("/".join([OUT_PATH_BASE, name]))
+        return super().tearDown()
+
+    def test_export_counts_in_chunks(self) -> None:
+        out_dir = "/".join([OUT_PATH_BASE, "counts"])
+        generate_not_normal_distribution_graphs(out_dir, 7, 4, 25.0, 75.0, 20.0, 10.0, 600, 400, 50, 'png', seed=3,
+            workers=2, output_format='counts', shard_size=3, progress='none')
+        self.assertEqual(sorted(os.listdir(out_dir)), ["counts-000000.npz", "counts-000001.npz", "counts-000002.npz"])
+        with np.load(os.path.join(out_dir, "counts-000001.npz")) as data:
+            self.assertEqual(data['counts'].dtype, np.uint8)
+            self.assertEqual(data['index'].tolist(), [3, 4, 5])
+        record = read_counts(os.path.join(out_dir, "counts-000001.npz"))[1]
+        counts, edges = histogram_batch(False, 3, range(4, 5),
+            {'loc1': 25.0, 'loc2': 75.0, 'scale1': 20.0, 'scale2': 10.0, 'size1': 600, 'size2': 400, 'bins': 50},
+            get_options({}))
+        self.assertEqual({name: record[name] for name in ['label', 'index', 'seed', 'loc2', 'size1', 'bins']},
+            {'label': 'false', 'index': 4, 'seed': 3, 'loc2': 75.0, 'size1': 600, 'bins': 50})
+        self.assertTrue(np.array_equal(record['counts'], counts[0]))
+        self.assertTrue(np.array_equal(record['edges'], edges[0]))
+
+    def test_failed_chunk_is_not_published(self) -> None:
+        import bin.normal_distribution_graph_generator as generator
+        out_dir = "/".join([OUT_PATH_BASE, "counts"])
+        def failing_get_metadata(is_normal_distribution, index, seed, params):
+            if index == 3:
+                raise RuntimeError("failed at 3")
+            return get_metadata(is_normal_distribution, index, seed, params)
+        with mock.patch.object(generator, 'get_metadata', failing_get_metadata):
+            with self.assertRaises(RuntimeError):
+                generate_normal_distribution_graphs(out_dir, 10, 4, 50.0, 20.0, 1000, 100, 'png', seed=3,
+                    output_format='counts', shard_size=10)
+        self.assertEqual(os.listdir(out_dir), [])
+
+    def test_render_counts_matches_direct_generation(self) -> None:
+        counts_dir = "/".join([OUT_PATH_BASE, "counts"])
+        direct_dir = "/".join([OUT_PATH_BASE, "direct"])
+        rendered_dir = "/".join([OUT_PATH_BASE, "rendered"])
+        os.makedirs(os.path.join(counts_dir, "true"))
+        os.makedirs(os.path.join(direct_dir, "true"))
+        generate_normal_distribution_graphs(os.path.join(counts_dir, "true"), 5, 4, 50.0, 20.0, 1000, 100, 'png', seed=8,
+            output_format='counts', shard_size=2, progress='none')
+        generate_normal_distribution_graphs(os.path.join(direct_dir, "true"), 5, 4, 50.0, 20.0, 1000, 100, 'png', seed=8,
+            progress='none')
+        stats = render_counts([counts_dir], rendered_dir, 4, 'png', workers=2, progress='none')
+        self.assertEqual(stats['images'], 5)
+        names = sorted(os.listdir(os.path.join(direct_dir, "true")))
+        self.assertEqual(names, sorted(os.listdir(os.path.join(rendered_dir, "true"))))
+        for name in names:
+            self.assertTrue(filecmp.cmp(os.path.join(direct_dir, "true", name),
+                os.path.join(rendered_dir, "true", name), shallow=False))
+
+        shutil.rmtree(os.path.join(rendered_dir, "true"))
+        render_counts([os.path.join(counts_dir, "true", "counts-000001.npz")], rendered_dir, 4, 'png', labels=['true'],
+            start=3, stop=5, progress='none', backend='raster', width=64, height=64)
+        self.assertEqual(sorted(os.listdir(os.path.join(rendered_dir, "true"))), names[3:4])
+        with self.assertRaises(ValueError):
+            render_counts([counts_dir], rendered_dir, 4, 'png', output_format='npy')
+
+
+class ServeTest(unittest.TestCase):
+    def setUp(self) -> None:
+        for name in ["served", "direct"]:
+            os.makedirs("/".join([OUT_PATH_BASE, name, "true"]))
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        for name in ["served", "direct"]:
+            shutil.rmtree("/".join([OUT_PATH_BASE, name]))
+        return super().tearDown()
+
+    def test_dry_run_skips_numpy_and_matplotlib(self) -> None:
+        code = ("import runpy, sys\n"
+            "sys.argv = ['generator', '--dry-run', '-n', '10', '--shard', '1/2', '--seed', '3']\n"
+            "try:\n"
+            "    runpy.run_path('bin/normal_distribution_graph_generator.py', run_name='__main__')\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "print(sorted(name for name in ['numpy.random', 'matplotlib'] if name in sys.modules))\n")
+        output = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True).stdout.decode()
+        self.assertIn("true: 5 images [5, 10) of 10", output)
+        self.assertEqual(output.splitlines()[-1], "[]")
+        self.assertFalse(os.listdir("/".join([OUT_PATH_BASE, "served", "true"])))
+
+    def test_serve_generates_with_warm_pool(self) -> None:
+        import bin.normal_distribution_graph_generator as generator
+        options = {'backend': 'raster', 'width': 64, 'height': 64, 'progress': 'none'}
+        pool = WorkerPool(2, options)
+        install_worker_pool(pool)
+        server = make_server(('127.0.0.1', 0), pool, options)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = "http://127.0.0.1:{}".format(server.server_address[1])
+            with urllib.request.urlopen(url + "/health") as response:
+                self.assertEqual(json.load(response), {'status': 'ok', 'workers': 2})
+            request = {'is_normal_distribution': True, 'out': "/".join([OUT_PATH_BASE, "served"]), 'number': 5,
+                'seed': 4}
+            with urllib.request.urlopen(url + "/generate", json.dumps(request).encode()) as response:
+                stats = json.load(response)
+            self.assertEqual((stats['images'], stats['workers'], stats['seed']), (5, 2, 4))
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(url + "/generate", json.dumps(dict(request, image_mode='cmyk')).encode())
+            self.assertEqual(context.exception.code, 400)
+            self.assertIn("cmyk", json.load(context.exception)['error'])
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(url + "/generate", json.dumps(dict(request, lco=50.0)).encode())
+            self.assertEqual(context.exception.code, 400)
+            self.assertEqual(json.load(context.exception)['error'], "Unknown fields: lco")
+            with mock.patch.object(generator, 'generate_graphs', side_effect=RuntimeError("worker died")):
+                with self.assertRaises(urllib.error.HTTPError) as context:
+                    urllib.request.urlopen(url + "/generate", json.dumps(request).encode())
+            self.assertEqual(context.exception.code, 500)
+            self.assertEqual(json.load(context.exception)['error'], "RuntimeError: worker died")
+        finally:
+            server.shutdown()
+            server.server_close()
+            install_worker_pool(None)
+            pool.shutdown()
+
+        direct_dir = "/".join([OUT_PATH_BASE, "direct", "true"])
+        generate_normal_distribution_graphs(direct_dir, 5, 4, 50.0, 20.0, 1000, 100, 'png', seed=4, **options)
+        served_dir = "/".join([OUT_PATH_BASE, "served", "true"])
+        names = sorted(os.listdir(direct_dir))
+        self.assertEqual(names, sorted(os.listdir(served_dir)))
+        for name in names:
+            self.assertTrue(filecmp.cmp(os.path.join(direct_dir, name), os.path.join(served_dir, name), shallow=False))
+
+
+class FanoutTest(unittest.TestCase):
+    def setUp(self) -> None:
+        os.makedirs("/".join([OUT_PATH_BASE, "true"]))
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree("/".join([OUT_PATH_BASE, "true"]))
+        shutil.rmtree("/".join([OUT_PATH_BASE, "true.manifest"]), ignore_errors=True)
+        return super().tearDown()
+
+    def test_fanout_layout_and_index(self) -> None:
+        out_dir = "/".join([OUT_PATH_BASE, "true"])
+        manifest = "/".join([OUT_PATH_BASE, "true.manifest"])
+        options = {'backend': 'raster', 'width': 32, 'height': 32, 'progress': 'none', 'manifest': manifest,
+            'fanout': 2}
+        for seed in [5, 6]:
+            generate_normal_distribution_graphs(out_dir, 20, 4, 50.0, 20.0, 1000, 100, 'png', seed=seed, workers=2,
+                **options)
+        self.assertEqual(sorted(os.listdir(manifest)), ["fold.lock", "index.json", "manifest.jsonl"])
+        index = read_index(manifest)
+        self.assertEqual(sorted(index), list(range(20)))
+        first = read_index(manifest, seed=5)
+        self.assertEqual(len(set(first.values()) | set(index.values())), 40)
+        for i, path in first.items():
+            key = sha256("5-{}".format(i).encode())
+            self.assertEqual(path, os.path.join(out_dir, key[:2], key[2:4],
+                "{}_{}_loc50.0_scale20.0_size1000_bins100.png".format(key[:16], str(i).zfill(4))))
+            self.assertTrue(os.path.exists(path))
+        with self.assertRaises(ValueError):
+            get_options({'fanout': 2, 'manifest': manifest, 'output_format': 'shards'})
+        with self.assertRaises(ValueError):
+            get_options({'fanout': 2})
+
+    def test_read_index_during_a_run(self) -> None:
+        import bin.normal_distribution_graph_generator as generator
+        out_dir = "/".join([OUT_PATH_BASE, "true"])
+        manifest = "/".join([OUT_PATH_BASE, "true.manifest"])
+        options = {'backend': 'raster', 'width': 32, 'height': 32, 'progress': 'none', 'manifest': manifest,
+            'fanout': 1}
+        generate_normal_distribution_graphs(out_dir, 4, 4, 50.0, 20.0, 1000, 100, 'png', seed=5, **options)
+        seen = []
+        add = generator.ManifestSegment.add
+        def add_and_read(segment, record):
+            add(segment, record)
+            files = {name: os.stat(os.path.join(manifest, name)).st_mtime_ns for name in os.listdir(manifest)}
+            seen.append(sorted(read_index(manifest, seed=6)))
+            self.assertEqual(len(read_index(manifest, seed=5)), 4)
+            # Reading changes nothing in the manifest.
+            self.assertEqual({name: os.stat(os.path.join(manifest, name)).st_mtime_ns
+                for name in os.listdir(manifest)}, files)
+        with mock.patch.object(generator.ManifestSegment, 'add', add_and_read):
+            generate_normal_distribution_graphs(out_dir, 4, 4, 50.0, 20.0, 1000, 100, 'png', seed=6, **options)
+        self.assertEqual(seen, [list(range(stop)) for stop in range(1, 5)])
+        self.assertEqual(sorted(read_index(manifest, seed=6)), list(range(4)))
+
+    def test_flat_rerun_with_other_seed_is_refused(self) -> None:
+        out_dir = "/".join([OUT_PATH_BASE, "true"])
+        options = {'backend': 'raster', 'progress': 'none', 'manifest': "/".join([OUT_PATH_BASE, "true.manifest"])}
+        generate_normal_distribution_graphs(out_dir, 3, 4, 50.0, 20.0, 1000, 100, 'png', seed=1, **options)
+        with self.assertRaises(ValueError):
+            generate_normal_distribution_graphs(out_dir, 3, 4, 50.0, 20.0, 1000, 100, 'png', seed=2, **options)
+        stats = generate_normal_distribution_graphs(out_dir, 4, 4, 50.0, 20.0, 1000, 100, 'png', **options)
+        self.assertEqual((stats['seed'], stats['images']), (1, 1))
+
+
+class VerifyTest(unittest.TestCase):
+    SPEC = {'classes': {
+        'true': {'number': 2, 'params': {'size': {'randint': [10, 2000]}, 'bins': {'grid': [10, 100]}}},
+        'false': {'number': 2, 'distribution': 'skewnormal', 'params': {'shape': 4.0}},
+    }}
+
+    def test_fast_paths_match_reference(self) -> None:
+        stats = verify_graphs(self.SPEC, seed=1, workers=2, backends=['matplotlib'], progress='none')
+        self.assertEqual((stats['checked'], stats['failures'], stats['seed']), (4, [], 1))
+        stats = verify_graphs(self.SPEC, seed=1, backends=['matplotlib'], progress='none', hist_range=(0.0, 100.0),
+            out_of_range='clip', chunk_size=77)
+        self.assertEqual(stats['failures'], [])
+
+    def test_failures_report_parameters(self) -> None:
+        stats = verify_graphs(self.SPEC, seed=1, sampling_modes=[], backends=['raster'], max_diff=0.0, min_ssim=1.0,
+            progress='none', width=64, height=64, axes=False)
+        self.assertEqual(len(stats['failures']), 4)
+        failure = stats['failures'][0]
+        self.assertEqual((failure['label'], failure['index'], failure['check']), ('false', 0, 'image:raster'))
+        self.assertEqual(failure['params']['distribution'], 'skewnormal')
+        self.assertLess(failure['ssim'], 1.0)
+
+        import bin.normal_distribution_graph_generator as generator
+        def shifted_histogram_batch(*args):
+            counts, edges = histogram_batch(*args)
+            return counts + 1, edges
+        with mock.patch.object(generator, 'histogram_batch', shifted_histogram_batch):
+            stats = verify_graphs(self.SPEC, seed=1, sampling_modes=['streaming'], backends=[], progress='none')
+        self.assertEqual([(failure['index'], failure['check']) for failure in stats['failures'] if failure['label'] == 'true'],
+            [(0, 'counts:streaming'), (1, 'counts:streaming')])
+        self.assertEqual(stats['failures'][-1]['params']['bins'], 100)
+        self.assertEqual(stats['failures'][-1]['mismatched_bins'], 100)
+        with self.assertRaises(ValueError):
+            verify_graphs(self.SPEC, sampling_modes=['multinomial'])
+
+    def test_ssim(self) -> None:
+        image = np.random.default_rng(0).integers(0, 256, size=(32, 32)).astype(np.uint8)
+        self.assertAlmostEqual(ssim(image, image), 1.0)
+        self.assertLess(ssim(image, 255 - image), 0.0)
+
 
 if __name__ == '__main__':
     unittest.main()